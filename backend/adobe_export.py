@@ -0,0 +1,269 @@
+# backend/adobe_export.py
+import asyncio, email.utils, os, random, time
+from typing import Any, Coroutine, Dict, Optional
+
+import httpx
+
+from backend.cache import docx_cache
+from backend.loop_thread import LoopThread
+from backend.metrics import adobe_exports, adobe_retries
+
+
+
+
+
+
+class AdobeExportError(Exception):
+    """PDF → DOCX export failure. `reason` is one of:
+
+    - "auth": credentials refused
+    - "throttled": still 429 after every retry (quota exhausted)
+    - "rejected": Adobe refused the input (encrypted, corrupt, too large…)
+    - "failed": the export job ran and failed
+    - "timeout": no result within ADOBE_EXPORT_TIMEOUT
+    - "unavailable": network errors / 5xx after every retry
+    """
+
+    def __init__(self, reason: str, detail: str = ""):
+        super().__init__(f"Adobe export {reason}" + (f": {detail}" if detail else ""))
+        self.reason = reason
+        self.detail = detail
+
+
+
+
+
+
+class AdobeExporter:
+    """PDF → DOCX through the Adobe PDF Services REST API, without the SDK.
+
+    token → asset upload → exportpdf job → status polling → download, all on
+    one keep-alive httpx pool driven by a private event loop (like the LLM
+    gateway), so a conversion waiting on Adobe holds no thread.
+
+    - at most ADOBE_MAX_IN_FLIGHT exports run at Adobe at once (our quota)
+    - 429 / 5xx / network errors are retried with backoff (Retry-After honoured)
+    - DOCX results are cached by sha256 of the PDF, and identical PDFs
+      converted concurrently share one export
+    - failures raise AdobeExportError with a typed `reason`
+
+    Point it at a local fake with ADOBE_BASE_URL or `configure()`.
+    """
+
+    def __init__(self, **settings: Any):
+        self._loop_thread = LoopThread("adobe-export")
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._token: Optional[str] = None
+        self._token_expires = 0.0
+        self._token_lock: Optional[asyncio.Lock] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._settings = settings
+
+    def _apply_settings(self, settings: Dict[str, Any]):
+        # Resolved when the client is built, i.e. after load_dotenv() has run
+        self.base_url = settings.get("base_url") or os.getenv("ADOBE_BASE_URL", "https://pdf-services.adobe.io")
+        self.client_id = settings.get("client_id") or os.getenv("ADOBE_CLIENT_ID")
+        self.client_secret = settings.get("client_secret") or os.getenv("ADOBE_CLIENT_SECRET")
+        self.max_in_flight = int(settings.get("max_in_flight") or os.getenv("ADOBE_MAX_IN_FLIGHT", "4"))
+        self.max_retries = int(settings.get("max_retries", os.getenv("ADOBE_MAX_RETRIES", "5")))
+        self.poll_interval = float(settings.get("poll_interval") or os.getenv("ADOBE_POLL_INTERVAL", "1"))
+        self.poll_max_interval = float(settings.get("poll_max_interval") or os.getenv("ADOBE_POLL_MAX_INTERVAL", "5"))
+        self.export_timeout = float(settings.get("export_timeout") or os.getenv("ADOBE_EXPORT_TIMEOUT", "600"))
+        self.ocr_lang = settings.get("ocr_lang") or os.getenv("ADOBE_OCR_LANG", "fr-FR")
+
+    # -----------------------------
+    # Pooled client (on the exporter loop)
+    # -----------------------------
+    def _get_client(self) -> httpx.AsyncClient:
+        # Only ever called on the exporter loop, so no locking needed
+        if self._client is None:
+            self._apply_settings(self._settings)
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(120, connect=10),
+                limits=httpx.Limits(max_connections=4 * self.max_in_flight),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._token_lock = asyncio.Lock()
+        return self._client
+
+    # -----------------------------
+    # HTTP with auth + backoff
+    # -----------------------------
+    async def _access_token(self, refresh: bool = False) -> str:
+        async with self._token_lock:
+            if refresh or self._token is None or time.time() > self._token_expires:
+                if not self.client_id or not self.client_secret:
+                    raise AdobeExportError("auth", "ADOBE_CLIENT_ID / ADOBE_CLIENT_SECRET not set")
+                response = await self._request("POST", "/token", auth=False, data={
+                    "client_id": self.client_id, "client_secret": self.client_secret,
+                })
+                body = response.json()
+                self._token = body["access_token"]
+                # Renew a minute early rather than racing the expiry
+                self._token_expires = time.time() + int(body.get("expires_in", 3600)) - 60
+            return self._token
+
+    @staticmethod
+    def _retry_after(response: Optional[httpx.Response], attempt: int) -> float:
+        header = response.headers.get("retry-after") if response is not None else None
+        if header:
+            try:
+                return min(float(header), 60.0)
+            except ValueError:
+                pass
+            try:
+                parsed = email.utils.parsedate_to_datetime(header)
+                return min(max(parsed.timestamp() - time.time(), 0.0), 60.0)
+            except (TypeError, ValueError):
+                pass
+        return min(2 ** attempt, 30) * random.uniform(0.5, 1.5)
+
+    async def _request(self, method: str, url: str, auth: bool = True, **kwargs: Any) -> httpx.Response:
+        """One API call, retried on 429 / 5xx / network errors; 401 renews the token once."""
+        client = self._get_client()
+        extra_headers = kwargs.pop("headers", None) or {}
+        refreshed = False
+        for attempt in range(self.max_retries + 1):
+            headers = dict(extra_headers)
+            if auth:
+                headers["Authorization"] = f"Bearer {await self._access_token()}"
+                headers["x-api-key"] = self.client_id
+            last_attempt = attempt == self.max_retries
+            try:
+                response = await client.request(method, url, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                if last_attempt:
+                    raise AdobeExportError("unavailable", str(e) or type(e).__name__)
+                response = None
+
+            if response is not None:
+                if response.status_code == 401 and auth and not refreshed:
+                    refreshed = True
+                    await self._access_token(refresh=True)
+                    continue
+                if response.status_code in (401, 403):
+                    raise AdobeExportError("auth", response.text[:200])
+                if response.status_code != 429 and response.status_code < 500:
+                    if response.status_code >= 400:
+                        raise AdobeExportError("rejected", response.text[:200])
+                    return response
+                if last_attempt:
+                    reason = "throttled" if response.status_code == 429 else "unavailable"
+                    raise AdobeExportError(reason, f"HTTP {response.status_code}")
+
+            adobe_retries.inc(status=str(response.status_code) if response is not None else "network")
+            await asyncio.sleep(self._retry_after(response, attempt))
+        raise AdobeExportError("unavailable", "no attempt made")  # max_retries < 0
+
+    # -----------------------------
+    # Export
+    # -----------------------------
+    async def _export(self, pdf: bytes) -> bytes:
+        async with self._semaphore:
+            asset = (await self._request("POST", "/assets", json={"mediaType": "application/pdf"})).json()
+            # httpx sends anything but bytes as a chunk iterator (uploads are bytearrays)
+            await self._request("PUT", asset["uploadUri"], auth=False, content=bytes(pdf),
+                                headers={"Content-Type": "application/pdf"})
+            submitted = await self._request("POST", "/operation/exportpdf", json={
+                "assetID": asset["assetID"], "targetFormat": "docx", "ocrLang": self.ocr_lang,
+            })
+            location = submitted.headers.get("location")
+            if not location:
+                raise AdobeExportError("failed", "no job location returned")
+
+            # Non-blocking status polling: the slot stays taken while Adobe works on it
+            deadline = time.monotonic() + self.export_timeout
+            interval = self.poll_interval
+            while True:
+                status = (await self._request("GET", location)).json()
+                if status.get("status") == "done":
+                    download_uri = status["asset"]["downloadUri"]
+                    break
+                if status.get("status") == "failed":
+                    error = status.get("error") or {}
+                    raise AdobeExportError("failed", error.get("message") or error.get("code") or "")
+                if time.monotonic() + interval > deadline:
+                    raise AdobeExportError("timeout", f"still running after {self.export_timeout:g} s")
+                await asyncio.sleep(interval)
+                interval = min(interval * 1.5, self.poll_max_interval)
+
+            return (await self._request("GET", download_uri, auth=False)).content
+
+    async def _export_once(self, pdf: bytes) -> bytes:
+        self._get_client()
+        key = docx_cache.key(pdf, self.ocr_lang)
+        cached = docx_cache.get(key)
+        if cached is not None:
+            adobe_exports.inc(outcome="cached")
+            return cached
+
+        # The same PDF already on its way: wait for that export instead of paying twice
+        pending = self._pending.get(key)
+        if pending is not None:
+            adobe_exports.inc(outcome="shared")
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            docx = await self._export(pdf)
+            docx_cache.put(key, docx)
+            future.set_result(docx)
+        except AdobeExportError as e:
+            adobe_exports.inc(outcome=e.reason)
+            future.set_exception(e)
+            raise
+        except Exception as e:
+            adobe_exports.inc(outcome="failed")
+            error = AdobeExportError("failed", str(e))
+            future.set_exception(error)
+            raise error from e
+        finally:
+            self._pending.pop(key, None)
+            if not future.done():
+                future.cancel()  # cancelled export: waiters are cancelled too
+            elif not future.cancelled():
+                future.exception()  # mark retrieved, there may be no waiter
+
+        adobe_exports.inc(outcome="ok")
+        return docx
+
+    # -----------------------------
+    # Public API
+    # -----------------------------
+    async def export(self, pdf: bytes) -> bytes:
+        """DOCX bytes of `pdf`. Raises AdobeExportError."""
+        return await self._loop_thread.dispatch(self._export_once(pdf))
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None):
+        """Blocking bridge for worker threads. Never call it from a running event loop."""
+        return self._loop_thread.run(coro, timeout)
+
+    def warm_up(self):
+        """Open the pool and fetch an access token now rather than on the first export."""
+        self.run(self._warm_up())
+
+    async def _warm_up(self):
+        self._get_client()
+        await self._access_token()
+
+    def configure(self, **settings: Any):
+        """Swap credentials / base_url / limits (e.g. a local fake server in tests).
+        The current pool and token are dropped and rebuilt on the next export."""
+        self.run(self._reconfigure(settings))
+
+    async def _reconfigure(self, settings: Dict[str, Any]):
+        client, self._client = self._client, None
+        self._token, self._token_expires = None, 0.0
+        self._settings = settings
+        if client is not None:
+            await client.aclose()
+
+
+
+
+
+
+adobe_exporter = AdobeExporter()
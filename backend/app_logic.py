@@ -1,23 +1,27 @@
 import os
 import io
 import fitz
-from google.cloud import vision
-from google.cloud.vision_v1 import types
-from openai import OpenAI
 from docx import Document
 from docx.shared import Pt
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from datetime import datetime
 import re
+import asyncio
 import base64
-from adobe.pdfservices.operation.auth.service_principal_credentials import ServicePrincipalCredentials
-from adobe.pdfservices.operation.pdf_services import PDFServices
-from adobe.pdfservices.operation.pdf_services_media_type import PDFServicesMediaType
-from adobe.pdfservices.operation.pdfjobs.jobs.export_pdf_job import ExportPDFJob
-from adobe.pdfservices.operation.pdfjobs.params.export_pdf.export_ocr_locale import ExportOCRLocale
-from adobe.pdfservices.operation.pdfjobs.params.export_pdf.export_pdf_params import ExportPDFParams
-from adobe.pdfservices.operation.pdfjobs.params.export_pdf.export_pdf_target_format import ExportPDFTargetFormat
-from adobe.pdfservices.operation.pdfjobs.result.export_pdf_result import ExportPDFResult 
+import json
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from backend.chunking import count_tokens, fits, input_budget, split_text, truncate_to_tokens
+from backend.llm_gateway import TEXT_MODEL, llm_gateway
+from backend.blank_pages import blank_page_counter, is_blank, is_empty
+from backend.cache import ocr_cache
+from backend.docx_engine import build_docx, extract_layout
+from backend.rendering import RENDER_PROFILE, render_page
+from backend.render_pool import render_pool
+from backend.metrics import ocr_calls, pages_processed, stage_seconds
+from backend.providers import vision_provider
+from backend.text_layer import extract_text_layer
 
 
 
@@ -37,9 +41,6 @@ os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = os.getenv('GOOGLE_APPLICATION_CRE
 os.environ['ADOBE_CLIENT_ID'] = os.getenv('ADOBE_CLIENT_ID')
 os.environ['ADOBE_CLIENT_SECRET'] = os.getenv('ADOBE_CLIENT_SECRET')
 
-# Initialize OpenAI client for gpt calls
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-
 
 
 
@@ -119,127 +120,431 @@ Analyze this page and classify it as either:
 It is crucial and extremely important that you output ONLY with either "TEXT", "IMAGE", or "SKIP"
 """
 
-# Function to process uploaded files and generate summaries and bordereau
-def process_uploaded_files(uploaded_files):
-    
-    """Process PDFs and generate summaries and bordereau."""
+# Classify the page AND describe it when it is an image, in a single vision call
+prompt_template_classify_describe = """
+Analyze this page and classify it as either:
+1. "TEXT" - if it contains meaningful text content that should be processed with OCR
+2. "IMAGE" - if it's primarily an image, photo, ID, or visual document that needs description
+3. "SKIP" - if it's a blank or nearly blank page with no meaningful content
 
-    client = vision.ImageAnnotatorClient()
-    all_summaries = []
-    bordereau_entries = []
-    
-    total_files = len(uploaded_files)
-    
-    # ---------- 0–70 %  : loop PDFs ----------
-    for index, pdf_file in enumerate(uploaded_files, 1):
+If and only if the label is "IMAGE", also describe the image:
+Tu reçois une image de document juridique en rapport avec une affaire.
+Décris cette image de document juridique en français de manière concise et factuelle.
+Retiens uniquement les éléments importants.
+Commence ta description par "La pièce image montre" et reste bref.
+2 à 3 phrases maximum.
 
-        pct = int(index / total_files * 70)
-        yield {"pct": pct,
-               "msg": f"L'IA traite les PDFs… ({index}/{total_files})"}
-        
-        # Extract piece number from filename
-        piece_num = re.search(r'\D*(\d+)', pdf_file.name)
-        piece_num = piece_num.group(1) if piece_num else "X"
-        
-        # Process PDF
-        pdf_content = pdf_file.read()
+Output ONLY a JSON object, without any other text:
+{"label": "TEXT" | "IMAGE" | "SKIP", "description": "<description if IMAGE, otherwise empty>"}
+"""
+
+# "1" sends one combined classify + describe request instead of two sequential
+# vision calls. Off by default: it sends the full image even for TEXT / SKIP
+# pages (instead of the low-detail thumbnail), and its descriptions come out
+# at temperature 0 and cached, unlike the temperature-1 description call.
+COMBINED_VISION_CALL = os.getenv("COMBINED_VISION_CALL", "0") == "1"
+
+# Maximum number of pages of a pièce being OCR'd / classified at the same time
+PAGE_CONCURRENCY = max(1, int(os.getenv("PAGE_CONCURRENCY", "4")))
+
+# Number of pièces of a dossier processed at the same time
+PIECE_CONCURRENCY = max(1, int(os.getenv("PIECE_CONCURRENCY", "4")))
+
+# Shared worker pool for the per-page Vision + GPT calls (network bound),
+# sized so every pièce being processed can keep PAGE_CONCURRENCY pages in flight
+PAGE_POOL_SIZE = max(1, int(os.getenv("PAGE_POOL_SIZE", str(PAGE_CONCURRENCY * PIECE_CONCURRENCY))))
+page_executor = ThreadPoolExecutor(max_workers=PAGE_POOL_SIZE, thread_name_prefix="page")
+
+# Shared pool for the pièces of every /summaries job: PIECE_CONCURRENCY per job,
+# for up to JOB_WORKERS jobs running at once
+PIECE_POOL_SIZE = max(1, int(os.getenv("PIECE_POOL_SIZE",
+                                       str(PIECE_CONCURRENCY * int(os.getenv("JOB_WORKERS", "4"))))))
+piece_executor = ThreadPoolExecutor(max_workers=PIECE_POOL_SIZE, thread_name_prefix="piece")
+
+# PyMuPDF is not thread-safe, even across documents: serialise all fitz calls
+fitz_lock = threading.Lock()
+
+# Function to get the text of a rendered page with Google Vision OCR
+def ocr_image(img_bytes):
+    image = {"content": img_bytes}
+    # The shared client is looked up on each attempt: another job may have replaced it meanwhile
+    vision_client = vision_provider.get()
+    try:
+        with stage_seconds.time(stage="ocr"):
+            response = vision_client.document_text_detection(image=image)
+    except Exception as e:
+        ocr_calls.inc(outcome="error")
+        if not vision_provider.is_transient(e):
+            raise  # bad input / quota: the client itself is fine, keep it
+        # Broken channel / expired auth: reconnect once, later calls get the new client
+        vision_provider.invalidate(vision_client)
+        with stage_seconds.time(stage="ocr"):
+            response = vision_provider.get().document_text_detection(image=image)
+    ocr_calls.inc(outcome="ok")
+    return response.full_text_annotation.text if response.full_text_annotation else ""
+
+# Function to OCR a rendered page and remember the result in the shared OCR cache
+def ocr_page(img_bytes, cache_key):
+    page_text = ocr_image(img_bytes)
+    ocr_cache.put(cache_key, page_text)
+    return page_text
+
+# Function to OCR a rendered page and classify / describe it when it has little text
+def analyse_page(rendered, page_text, source, cache_key):
+    """
+    Get the text of one page rendered by render_page() (page_text when it came
+    from the text layer or the OCR cache, OCR otherwise) and, for low-text
+    pages, classify it with GPT.
+    Returns (page_text, description, source): page_text is None when the page
+    must not be added to the transcript, description is only set for IMAGE
+    pages, source is "text_layer", "ocr_cache", "ocr" or "blank" (empty page,
+    skipped before OCR).
+    """
+    if page_text is None:
+        # Provably empty pages (no text layer, no image, nothing drawn) need neither OCR nor GPT
+        if is_empty(rendered["page_stats"]):
+            blank_page_counter.record(True, before_ocr=True)
+            return None, None, "blank"
+        # Get text using Google Vision OCR
+        page_text = ocr_page(rendered["image_bytes"], cache_key)
+
+    # Process based on content length
+    if len(page_text) > 700:
+        return page_text, None, source
+
+    # Obvious blank / separator pages are SKIPped locally, without a GPT call
+    skipped = is_blank(rendered["page_stats"], page_text)
+    blank_page_counter.record(skipped)
+    if skipped:
+        return None, None, source
+
+    # Classify (and describe) in one vision call; fall back to two calls if the answer is unusable
+    if COMBINED_VISION_CALL:
+        try:
+            image_base64 = base64.b64encode(rendered["image_bytes"]).decode('utf-8')
+            answer = process_with_gpt(
+                prompt=prompt_template_classify_describe,
+                image_base64=image_base64,
+                image_mime=rendered["image_mime"],
+                template="classify_describe"
+            )
+            parsed = parse_classify_describe(answer) if answer else None
+            if parsed:
+                label, description = parsed
+                if label == "TEXT":
+                    return page_text, None, source
+                if label == "IMAGE":
+                    return None, description, source
+                return None, None, source
+            print("Unparseable classify+describe answer, falling back to two calls")
+        except Exception as e:
+            print(f"Error processing page: {e}")
+
+    # Classify page with GPT (on the small thumbnail)
+    try:
+        classification = process_with_gpt(
+            prompt=prompt_template_classification,
+            image_base64=rendered["thumb_base64"],
+            is_classification=True,
+            image_mime=rendered["thumb_mime"],
+            detail=rendered["thumb_detail"],
+            template="classification"
+        )
+
+        if "TEXT" in classification:
+            return page_text, None, source
+        elif "IMAGE" in classification:
+            # Get image description (on the full image)
+            description = process_with_gpt(
+                prompt=prompt_template_image,
+                image_base64=base64.b64encode(rendered["image_bytes"]).decode('utf-8'),
+                is_image_description=True,
+                image_mime=rendered["image_mime"],
+                template="image"
+            )
+            if description:
+                return None, description, source
+    except Exception as e:
+        print(f"Error processing page: {e}")
+
+    return None, None, source
+
+# Function to parse the JSON answer of prompt_template_classify_describe
+def parse_classify_describe(answer):
+    """
+    Return (label, description) from a classify+describe answer, or None when
+    it can't be trusted. Tolerates code fences, text around the JSON object and
+    a plain "LABEL" first line followed by the description.
+    """
+    text = answer.strip()
+    text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text).strip()
+
+    label, description = None, ""
+    match = re.search(r'\{.*\}', text, re.DOTALL)
+    if match:
+        try:
+            data = json.loads(match.group(0))
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            label = str(data.get("label") or data.get("classification") or "").strip().upper()
+            description = str(data.get("description") or "").strip()
+    if label is None:
+        first_line, _, rest = text.partition('\n')
+        label = first_line.strip().strip('"*:. ').upper()
+        description = rest.strip()
+
+    if label not in ("TEXT", "IMAGE", "SKIP"):
+        return None
+    if label == "IMAGE" and not description:
+        return None
+    return label, (description if label == "IMAGE" else None)
+
+# Function to render a page in the render process pool, then analyse it
+def analyse_pooled_page(pooled, page_index, page_text, source, cache_key):
+    with stage_seconds.time(stage="render"):
+        rendered = pooled.render(page_index).result()
+    return analyse_page(rendered, page_text, source, cache_key)
+
+# Function to read / render the pages of a PDF and analyse them concurrently, in page order
+def iter_page_results(pdf_document, document_hash, pooled=None):
+    """
+    Walk pages one after another (fitz calls under fitz_lock). Pages with more
+    than 700 characters from the text layer or the OCR cache are done right
+    away; the others are rendered and handed to page_executor, keeping at most
+    PAGE_CONCURRENCY pages in flight. Yields the analyse_page results in page order.
+    With `pooled` (a render_pool document), rendering happens in the worker
+    processes instead of under fitz_lock here.
+    """
+    pending = deque()
+    try:
+        for page_index in range(len(pdf_document)):
+            with fitz_lock:
+                page = pdf_document[page_index]
+                page_text, source = extract_text_layer(page), "text_layer"
+
+            cache_key = ocr_cache.page_key(document_hash, page_index, RENDER_PROFILE)
+            if page_text is None:
+                page_text = ocr_cache.get(cache_key)
+                source = "ocr" if page_text is None else "ocr_cache"
+
+            if page_text is not None and len(page_text) > 700:
+                # Plenty of text already known: no rendering, no OCR
+                future = Future()
+                future.set_result((page_text, None, source))
+            elif pooled is not None:
+                # Rasterised in a render worker process (outside the GIL)
+                future = page_executor.submit(analyse_pooled_page, pooled,
+                                              page_index, page_text, source, cache_key)
+            else:
+                # Convert page to image(s) with the configured render profile
+                with fitz_lock, stage_seconds.time(stage="render"):
+                    rendered = render_page(page)
+                future = page_executor.submit(analyse_page, rendered, page_text, source, cache_key)
+            pending.append(future)
+            if len(pending) >= PAGE_CONCURRENCY:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Don't leave queued pages running if the pièce failed halfway
+        for future in pending:
+            future.cancel()
+
+# Function to split a text over a token budget into prompt_template_general chunks
+def chunks_over_budget(text, max_tokens):
+    """None when text fits in max_tokens, else its chunks."""
+    if fits(text, max_tokens):
+        return None
+    return split_text(text, input_budget(TEXT_MODEL, prompt_template_general))
+
+# Function to bring a text under a token budget by summarising it chunk by chunk
+async def condense_to_budget_async(text, max_tokens):
+    """
+    Summarise text with prompt_template_general, chunk by chunk and level after
+    level, until it fits in max_tokens. Truncates if a level stops shrinking it.
+    Runs on the LLM gateway loop: token counting and splitting (tiktoken) go
+    through asyncio.to_thread, only the GPT calls are awaited on the loop.
+    """
+    while True:
+        chunks = await asyncio.to_thread(chunks_over_budget, text, max_tokens)
+        if chunks is None:
+            return text
+        condensed = '\n\n'.join(await summarize_chunks_async(chunks))
+        if not condensed or await asyncio.to_thread(lambda: count_tokens(condensed) >= count_tokens(text)):
+            return await asyncio.to_thread(truncate_to_tokens, text, max_tokens)
+        text = condensed
+
+# Function to summarise a pièce transcript of any length with prompt_template_summary
+async def summarize_transcript_async(full_transcript):
+    transcript = await condense_to_budget_async(
+        full_transcript, input_budget(TEXT_MODEL, prompt_template_summary)
+    )
+    return await process_with_gpt_async(
+        prompt=prompt_template_summary.format(transcript),
+        template="summary"
+    )
+
+# Function to process one pièce: OCR its pages, then generate its summary and bordereau line
+def process_piece(pdf_file):
+    """
+    Process a single PDF pièce.
+    Returns {"piece", "summary", "bordereau", "date", "sources"}: piece is the
+    number read from the filename, bordereau is None if GPT failed, date
+    ("JJ mois AAAA") is None when the summary doesn't start with one, sources
+    says how each page was read ("text_layer", "ocr_cache", "ocr" or "blank").
+    """
+    # Extract piece number from filename
+    piece_num = re.search(r'\D*(\d+)', pdf_file.name)
+    piece_num = piece_num.group(1) if piece_num else "X"
+    
+    # Process PDF
+    pdf_content = pdf_file.read()
+    with fitz_lock:
         pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
-        
-        transcript = []
-        image_descriptions = []
-        
-        # Process each page
-        for page in pdf_document:
-            # Convert page to image
-            zoom = 300 / 72  # 300 DPI
-            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
-            img_bytes = pix.tobytes()
-            
-            # Get text using Google Vision OCR
-            image = types.Image(content=img_bytes)
-            response = client.document_text_detection(image=image)
-            page_text = response.full_text_annotation.text if response.full_text_annotation else ""
-            
-            # Process based on content length
-            if len(page_text) > 700:
+    
+    transcript = []
+    image_descriptions = []
+    page_sources = []
+    
+    # Process each page (OCR + classification run concurrently, results in page order)
+    document_hash = ocr_cache.document_hash(pdf_content)
+    pooled = render_pool.open(pdf_content)  # None unless RENDER_POOL=1
+    try:
+        for page_text, description, source in iter_page_results(pdf_document, document_hash, pooled):
+            page_sources.append(source)
+            pages_processed.inc(source=source)
+            if page_text is not None:
                 transcript.append(page_text)
-            else:
-                # Classify page with GPT
-                try:
-                    base64_image = base64.b64encode(img_bytes).decode('utf-8')
-                    classification = process_with_gpt(
-                        prompt=prompt_template_classification,
-                        image_base64=base64_image,
-                        is_classification=True
-                    )
-                    
-                    if "TEXT" in classification:
-                        transcript.append(page_text)
-                    elif "IMAGE" in classification:
-                        # Get image description
-                        description = process_with_gpt(
-                            prompt=prompt_template_image,
-                            image_base64=base64_image,
-                            is_image_description=True
-                        )
-                        if description:
-                            image_descriptions.append(description)
-                except Exception as e:
-                    print(f"Error processing page: {e}")
-        
-        # Create summary for this PDF
-        full_transcript = '\n\n'.join(transcript)
-        if full_transcript:
-            # Summarize transcript
-            summary = process_with_gpt(
-                prompt=prompt_template_summary.format(full_transcript)
-            )
-            if summary:
-                # Add image descriptions and piece number
-                if image_descriptions:
-                    desc_text = "\n\n".join(image_descriptions)
-                    summary = f"{summary}{desc_text} (Pièce nº{piece_num})"
-                else:
-                    summary = f"{summary} (Pièce nº{piece_num})"
-        else:
-            # Images-only piece
+            if description:
+                image_descriptions.append(description)
+    finally:
+        if pooled is not None:
+            pooled.close()
+    
+    full_transcript = '\n\n'.join(transcript)
+    images_text = "\n\n".join(image_descriptions)
+    
+    # Summary (or image title) and bordereau line don't depend on each other:
+    # send both GPT calls at once and merge the date once both are back
+    combined_text = full_transcript
+    if image_descriptions:
+        combined_text += images_text
+    
+    # The title only needs the beginning of a huge pièce
+    bordereau_future = llm_gateway.submit(process_with_gpt_async(
+        prompt=prompt_template_bordereau.format(
+            truncate_to_tokens(combined_text, input_budget(TEXT_MODEL, prompt_template_bordereau))
+        ),
+        template="bordereau"
+    ))
+    if full_transcript:
+        # Summarize transcript (condensed first if it exceeds the model's input budget)
+        summary_future = llm_gateway.submit(summarize_transcript_async(full_transcript))
+    elif image_descriptions:
+        # Images-only piece: generate a title from the descriptions
+        summary_future = llm_gateway.submit(process_with_gpt_async(
+            prompt=prompt_template_image_title.format(
+                truncate_to_tokens(images_text, input_budget(TEXT_MODEL, prompt_template_image_title))
+            ),
+            template="image_title"
+        ))
+    else:
+        summary_future = None
+    
+    # Create summary for this PDF
+    if full_transcript:
+        summary = summary_future.result()
+        if summary:
+            # Add image descriptions and piece number
             if image_descriptions:
-                images_text = "\n\n".join(image_descriptions)
-                title = process_with_gpt(
-                    prompt=prompt_template_image_title.format(images_text)
-                )
-                title = title if title else "Images"
-                summary = f"Le JJ mois AAAA, {title}\n\n{images_text} (Pièce nº{piece_num})"
+                summary = f"{summary}{images_text} (Pièce nº{piece_num})"
             else:
-                summary = f"Pièce vide (Pièce nº{piece_num})"
-        
-        all_summaries.append(summary)
-        
-        # NEW: Extract date from first line of summary
-        first_line = summary.strip().split('\n')[0]
-        date_match = re.match(r'Le (\d{1,2} \w+ \d{4})', first_line)
-        extracted_date = date_match.group(1) if date_match else "JJ mois AAAA"
-        
-        # Generate bordereau entry
-        combined_text = full_transcript
+                summary = f"{summary} (Pièce nº{piece_num})"
+    else:
+        # Images-only piece
         if image_descriptions:
-            combined_text += "\n\n".join(image_descriptions)
-        
-        bordereau_entry = process_with_gpt(
-            prompt=prompt_template_bordereau.format(combined_text)
-        )
-        if bordereau_entry:
-            # Format bordereau entry with piece number, title, and date
-            bordereau_entry = f"{piece_num} - {bordereau_entry} - du {extracted_date}"
-            bordereau_entries.append(bordereau_entry)
+            title = summary_future.result()
+            title = title if title else "Images"
+            summary = f"Le JJ mois AAAA, {title}\n\n{images_text} (Pièce nº{piece_num})"
+        else:
+            summary = f"Pièce vide (Pièce nº{piece_num})"
+    
+    # NEW: Extract date from first line of summary
+    first_line = summary.strip().split('\n')[0]
+    date_match = re.match(r'Le (\d{1,2} \w+ \d{4})', first_line)
+    extracted_date = date_match.group(1) if date_match else "JJ mois AAAA"
     
+    bordereau_entry = bordereau_future.result()
+    if bordereau_entry:
+        # Format bordereau entry with piece number, title, and date
+        bordereau_entry = f"{piece_num} - {bordereau_entry} - du {extracted_date}"
+
+    return {
+        "piece": piece_num,
+        "summary": summary,
+        "bordereau": bordereau_entry or None,
+        "date": date_match.group(1) if date_match else None,
+        "sources": page_sources,
+    }
+
+# Function to process uploaded files and generate summaries and bordereau
+def process_uploaded_files(uploaded_files):
+    
+    """
+    Process PDFs and generate summaries and bordereau.
+    Yields progress dicts, one {"piece_result": {...}} per pièce as soon as it is
+    done (upload position, pièce number, summary, bordereau line, date), then the
+    combined {"result": {"original", "chronological"}}.
+    """
+
+    total_files = len(uploaded_files)
+
+    # Results are stored by upload position so the output keeps the upload order
+    piece_results = [None] * total_files
+    
+    # ---------- 0–70 %  : process PDFs, PIECE_CONCURRENCY at a time ----------
+    yield {"pct": 0,
+           "msg": f"L'IA traite les PDFs… (0/{total_files})"}
+
+    # At most PIECE_CONCURRENCY pièces of this job in the shared pool at a time,
+    # so a big dossier doesn't hold every piece_executor thread
+    waiting = deque(enumerate(uploaded_files))
+    futures = {}
+    done_count = 0
+    try:
+        while waiting or futures:
+            while waiting and len(futures) < PIECE_CONCURRENCY:
+                position, pdf_file = waiting.popleft()
+                futures[piece_executor.submit(process_piece, pdf_file)] = position
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                position = futures.pop(future)
+                piece_results[position] = future.result()
+                done_count += 1
+
+                # Ship the pièce right away: the UI can show it before the whole dossier is done
+                yield {"piece_result": {"position": position, **piece_results[position]}}
+
+                pct = int(done_count / total_files * 70)
+                yield {"pct": pct,
+                       "msg": f"L'IA traite les PDFs… ({done_count}/{total_files})"}
+    finally:
+        # A failed pièce aborts the job: drop its pièces still queued in the shared pool
+        for future in futures:
+            future.cancel()
+
+    all_summaries = [piece["summary"] for piece in piece_results]
+    bordereau_entries = [piece["bordereau"] for piece in piece_results if piece["bordereau"]]
 
     # ---------- 70% → 85% : chrono sort ----------
     yield {"pct": 80, "msg": "Tri chronologique des résumés…"}
 
     # Combine all results
     combined_summaries = "\n\n------\n\n".join(all_summaries)
-    chronological_summary = sort_summaries_chronologically(combined_summaries)
+    with stage_seconds.time(stage="chrono_sort"):
+        chronological_summary = sort_summaries_chronologically(combined_summaries)
     
     # ---------- 85% → 100% : finalise ----------
     yield {"pct": 90, "msg": "Finalisation…"}
@@ -258,37 +563,22 @@ def process_uploaded_files(uploaded_files):
     }
 
 # Function to handle all GPT API calls, with or without images
-def process_with_gpt(prompt, image_base64=None, is_classification=False, is_image_description=False):
-    """Handle all GPT API calls, with or without images."""
+async def process_with_gpt_async(prompt, image_base64=None, is_classification=False, is_image_description=False,
+                                 image_mime="image/png", detail="high", template=None):
+    """
+    Handle all GPT API calls, with or without images, through the shared LLM gateway.
+    `template` names the prompt template; temperature-0 answers are cached under it.
+    """
     try:
-        messages = [{
-            "role": "user",
-            "content": [{"type": "text", "text": prompt}]
-        }]
-        
-        # Add image to message if provided
-        if image_base64:
-            messages[0]["content"].append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/png;base64,{image_base64}",
-                    "detail": "high"
-                }
-            })
-        
-        # Use gpt-4o for image-related tasks, gpt-4o-mini for text-only tasks
-        model = "gpt-4o" if image_base64 else "gpt-4o-mini-2024-07-18"
-        
         # Temperature 1 only for image descriptions, 0 for everything else
         temperature = 1 if is_image_description else 0
         
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature
-        )
-        
-        result = response.choices[0].message.content.strip()
+        # gpt-4o for image-related tasks, gpt-4o-mini for text-only tasks
+        if image_base64:
+            result = await llm_gateway.vision(prompt, image_base64, temperature=temperature,
+                                              detail=detail, mime=image_mime, template=template)
+        else:
+            result = await llm_gateway.text(prompt, temperature=temperature, template=template)
         
         # For classification, return uppercase result
         if is_classification:
@@ -299,6 +589,13 @@ def process_with_gpt(prompt, image_base64=None, is_classification=False, is_imag
         print(f"Error in GPT processing: {e}")
         return None
 
+def process_with_gpt(prompt, image_base64=None, is_classification=False, is_image_description=False,
+                     image_mime="image/png", detail="high", template=None):
+    """Blocking version of process_with_gpt_async for the worker threads."""
+    return llm_gateway.run(process_with_gpt_async(
+        prompt, image_base64, is_classification, is_image_description, image_mime, detail, template
+    ))
+
 # Function to sort summaries based only on their initial paragraph dates
 def sort_summaries_chronologically(combined_summaries):
     """
@@ -379,49 +676,30 @@ def create_summary_word_document(summary_text):
 
 ######################### CONVERTISSEUR PDF VERS WORD #########################
 
-def convert_pdf_to_word(uploaded_file):
+def convert_pdf_locally(uploaded_file):
     """
-    Convert PDF to Word using Adobe PDF Services API with OCR support.
+    Convert a born-digital PDF to Word in-process (text layer, fonts, tables).
+    Returns None for scans and complex layouts, which need Adobe.
     """
     try:
-        # Initialize credentials and service
-        credentials = ServicePrincipalCredentials(
-            client_id=os.environ["ADOBE_CLIENT_ID"],
-            client_secret=os.environ["ADOBE_CLIENT_SECRET"]
-        )
-        pdf_services = PDFServices(credentials=credentials)
-
-        # Upload PDF and set conversion parameters
-        input_asset = pdf_services.upload(
-            input_stream=uploaded_file.getvalue(), 
-            mime_type=PDFServicesMediaType.PDF
-        )
-        export_params = ExportPDFParams(
-            target_format=ExportPDFTargetFormat.DOCX,
-            ocr_lang=ExportOCRLocale.FR_FR
-        )
-
-        # Convert PDF to Word
-        export_job = ExportPDFJob(input_asset=input_asset, export_pdf_params=export_params)
-        location = pdf_services.submit(export_job)
-        result = pdf_services.get_job_result(location, ExportPDFResult)
-
-        # Prepare for download
-        word_buffer = io.BytesIO(
-            pdf_services.get_content(
-                result.get_result().get_asset()
-            ).get_input_stream()
-        )
-        word_buffer.seek(0)
-        
-        return word_buffer
+        with fitz_lock:
+            pdf_document = fitz.open(stream=uploaded_file.getvalue(), filetype="pdf")
+        try:
+            # fitz_lock is taken page by page, like iter_page_results does
+            layout = extract_layout(pdf_document, fitz_lock)
+        finally:
+            with fitz_lock:
+                pdf_document.close()
+        return build_docx(layout) if layout is not None else None
 
     except Exception as e:
+        print(f"Local PDF to Word conversion failed, falling back to Adobe: {e}")
         return None
 
 
-# upload only a single pdf file with convert_pdf_to_word(uploaded_file)
-# returns a word document ready for download
+# upload only a single pdf file with convert_pdf_locally(uploaded_file)
+# returns a word document ready for download, or None when Adobe is needed
+# (backend/adobe_export.py)
 
 
 ######################### RÉSUMÉ SIMPLE DE DOCUMENT PDF OU WORD #########################
@@ -437,14 +715,79 @@ N'ajoute pas "Le texte" au début.
 ((({})))
 """
 
-def create_single_document_summary(uploaded_file):
-    """Process PDF or Word document and generate summary."""
-    client = vision.ImageAnnotatorClient()
-    all_chunks_summaries = []
-    MAX_TOKENS = 1000  # Token limit for GPT
-    CHARS_PER_TOKEN = 4  # Approximate chars per token
-    MAX_CHUNK_SIZE = MAX_TOKENS * CHARS_PER_TOKEN
-    
+# Merge consecutive chunk summaries (reduce phase)
+prompt_template_reduce = """
+
+Fusionne les résumés successifs entre les triples parenthèses en un seul résumé cohérent.
+Conserve l'ordre chronologique et les informations importantes.
+N'ajoute pas de titre ou de conclusion.
+N'ajoute pas "Résumé" ou "Summary" au début.
+
+((({})))
+"""
+
+# Chunk size / overlap (tokens) for single-document summaries, capped by the model's input budget
+DOC_CHUNK_TOKENS = int(os.getenv("DOC_CHUNK_TOKENS", "3000"))
+DOC_CHUNK_OVERLAP = int(os.getenv("DOC_CHUNK_OVERLAP", "0"))
+
+# Chunk summaries generated at the same time for one document
+DOC_CHUNK_CONCURRENCY = max(1, int(os.getenv("DOC_CHUNK_CONCURRENCY", "8")))
+
+# Reduce phase: when there are more chunk summaries than DOC_REDUCE_ABOVE (0 = never),
+# merge them DOC_REDUCE_GROUP at a time, level after level
+DOC_REDUCE_ABOVE = int(os.getenv("DOC_REDUCE_ABOVE", "0"))
+DOC_REDUCE_GROUP = max(2, int(os.getenv("DOC_REDUCE_GROUP", "5")))
+
+# Function to summarise chunks in parallel (map) and optionally merge the results (reduce)
+async def summarize_chunks_async(chunks, progress=None):
+    """
+    Summarise every chunk with prompt_template_general, at most
+    DOC_CHUNK_CONCURRENCY at a time, keeping the chunk order. Failed chunks are
+    dropped, like before. `progress(done, total)` is called after each chunk.
+    """
+    semaphore = asyncio.Semaphore(DOC_CHUNK_CONCURRENCY)
+    done = 0
+
+    async def summarize(chunk_text):
+        nonlocal done
+        async with semaphore:
+            summary = await process_text_with_gpt_async(
+                prompt=prompt_template_general.format(chunk_text),
+                template="general"
+            )
+        done += 1
+        if progress:
+            progress(done, len(chunks))
+        return summary
+
+    summaries = await asyncio.gather(*(summarize(chunk) for chunk in chunks))
+    summaries = [summary for summary in summaries if summary]
+
+    # Reduce phase: merge neighbouring summaries until there are few enough
+    while DOC_REDUCE_ABOVE and len(summaries) > DOC_REDUCE_ABOVE:
+        groups = [summaries[i:i + DOC_REDUCE_GROUP] for i in range(0, len(summaries), DOC_REDUCE_GROUP)]
+
+        async def merge(group):
+            if len(group) == 1:
+                return group[0]
+            async with semaphore:
+                merged = await process_text_with_gpt_async(
+                    prompt=prompt_template_reduce.format('\n\n'.join(group)),
+                    template="reduce"
+                )
+            # Keep the unmerged summaries rather than losing content
+            return merged or '\n\n'.join(group)
+
+        summaries = await asyncio.gather(*(merge(group) for group in groups))
+
+    return summaries
+
+def create_single_document_summary(uploaded_file, progress=None):
+    """
+    Process PDF or Word document and generate summary.
+    `progress`, if given, receives {"pct", "msg"} dicts (10 → 80 %) as chunks are summarised.
+    """
+    max_chunk_tokens = min(DOC_CHUNK_TOKENS, input_budget(TEXT_MODEL, prompt_template_general))
     
     try:
         # Extract text based on file type
@@ -456,66 +799,59 @@ def create_single_document_summary(uploaded_file):
             full_text = '\n\n'.join(paragraph.text for paragraph in doc.paragraphs if paragraph.text.strip())
             
         elif file_extension == 'pdf':
-            # Process PDF with OCR
+            # Process PDF: embedded text layer when usable, OCR otherwise
             pdf_content = uploaded_file.read()
-            pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
+            with fitz_lock:
+                pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
+                total_pages = len(pdf_document)
+            document_hash = ocr_cache.document_hash(pdf_content)
+            pooled = render_pool.open(pdf_content)  # None unless RENDER_POOL=1
             
             full_text = []
-            total_pages = len(pdf_document)
             
-            for page_num, page in enumerate(pdf_document):
+            try:
+                for page_num in range(total_pages):
                 
-                # Convert page to image
-                zoom = 300 / 72  # 300 DPI
-                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
-                img_bytes = pix.tobytes()
+                    with fitz_lock:
+                        page = pdf_document[page_num]
+                        page_text = extract_text_layer(page)
                 
-                # Get text using Google Vision OCR
-                image = types.Image(content=img_bytes)
-                response = client.document_text_detection(image=image)
-                page_text = response.full_text_annotation.text if response.full_text_annotation else ""
+                    if page_text is not None:
+                        pages_processed.inc(source="text_layer")
+                    else:
+                        cache_key = ocr_cache.page_key(document_hash, page_num, RENDER_PROFILE)
+                        page_text = ocr_cache.get(cache_key)
+                        if page_text is not None:
+                            pages_processed.inc(source="ocr_cache")
+                        else:
+                            # Convert page to image with the configured render profile
+                            with stage_seconds.time(stage="render"):
+                                if pooled is not None:
+                                    rendered = pooled.render(page_num).result()
+                                else:
+                                    with fitz_lock:
+                                        rendered = render_page(page)
+                            # Get text using Google Vision OCR
+                            page_text = ocr_page(rendered["image_bytes"], cache_key)
+                            pages_processed.inc(source="ocr")
                 
-                if page_text.strip():
-                    full_text.append(page_text)
+                    if page_text.strip():
+                        full_text.append(page_text)
+            finally:
+                if pooled is not None:
+                    pooled.close()
             
             full_text = '\n\n'.join(full_text)
         
-        # Split text into paragraphs
-        paragraphs = [p for p in full_text.split('\n') if p.strip()]
-        
-        # Create chunks of text within token limit
-        current_chunk = []
-        current_chunk_size = 0
-        total_paragraphs = len(paragraphs)
-        
-        for i, paragraph in enumerate(paragraphs):
-            paragraph_size = len(paragraph)
-            
-            if current_chunk_size + paragraph_size > MAX_CHUNK_SIZE:
-                # Process current chunk
-                if current_chunk:
-                    chunk_text = '\n\n'.join(current_chunk)
-                    summary = process_text_with_gpt(
-                        prompt=prompt_template_general.format(chunk_text)
-                    )
-                    if summary:
-                        all_chunks_summaries.append(summary)
-                
-                # Start new chunk
-                current_chunk = [paragraph]
-                current_chunk_size = paragraph_size
-            else:
-                current_chunk.append(paragraph)
-                current_chunk_size += paragraph_size
-        
-        # Process final chunk if it exists
-        if current_chunk:
-            chunk_text = '\n\n'.join(current_chunk)
-            summary = process_text_with_gpt(
-                prompt=prompt_template_general.format(chunk_text)
-            )
-            if summary:
-                all_chunks_summaries.append(summary)
+        # Map phase: build all chunks first (sentence-aware, token-counted), then summarise them in parallel
+        chunks = split_text(full_text, max_chunk_tokens, overlap_tokens=DOC_CHUNK_OVERLAP)
+
+        def report_chunk(done, total):
+            if progress:
+                progress({"pct": 10 + int(done / total * 70),
+                          "msg": f"Génération du résumé… ({done}/{total})"})
+
+        all_chunks_summaries = llm_gateway.run(summarize_chunks_async(chunks, report_chunk))
         
         # Get document name without extension
         doc_name = os.path.splitext(uploaded_file.name)[0]
@@ -529,24 +865,19 @@ def create_single_document_summary(uploaded_file):
     except Exception as e:
         return None
 
-def process_text_with_gpt(prompt):
+async def process_text_with_gpt_async(prompt, template=None):
     """Handle GPT API calls for single document summarization."""
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini-2024-07-18",
-            messages=[{
-                "role": "user",
-                "content": prompt
-            }],
-            temperature=0
-        )
-        
-        return response.choices[0].message.content.strip()
+        return await llm_gateway.text(prompt, temperature=0, template=template)
             
     except Exception as e:
         print(f"Error in GPT processing: {e}")
         return None
 
+def process_text_with_gpt(prompt, template=None):
+    """Blocking version of process_text_with_gpt_async for the worker threads."""
+    return llm_gateway.run(process_text_with_gpt_async(prompt, template))
+
 def create_summary_word_document(summary_text, document_name):
     """Create a Word document from the summary text."""
     doc = Document()
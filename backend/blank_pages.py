@@ -0,0 +1,111 @@
+# backend/blank_pages.py
+import os, threading
+from typing import Dict
+
+from PIL import Image, ImageFilter, ImageStat
+
+
+
+
+
+
+# A page is SKIPped locally only when it is below EVERY threshold; anything
+# else is "ambiguous" and still goes to GPT classification.
+BLANK_DETECTION = os.getenv("BLANK_DETECTION", "1") != "0"
+BLANK_MAX_CHARS = int(os.getenv("BLANK_MAX_CHARS", "5"))           # OCR / text-layer characters
+BLANK_MAX_INK = float(os.getenv("BLANK_MAX_INK", "0.002"))         # share of dark pixels
+BLANK_MAX_STDEV = float(os.getenv("BLANK_MAX_STDEV", "12"))        # luminance standard deviation
+BLANK_MAX_EDGES = float(os.getenv("BLANK_MAX_EDGES", "0.004"))     # share of edge pixels
+
+# Before OCR, only a provably empty page is skipped: no text layer, no image and
+# (almost) no pixel off white. A signature line or "ANNEXE" alone is not empty.
+BLANK_EMPTY_MAX_MARKS = float(os.getenv("BLANK_EMPTY_MAX_MARKS", "0"))  # share of non-white pixels
+
+INK_LEVEL = 128      # luminance below which a pixel counts as ink
+EDGE_LEVEL = 48      # edge-filter response above which a pixel counts as an edge
+MARK_LEVEL = 240     # luminance below which a pixel counts as a mark (even faint / anti-aliased)
+SAMPLE_PX = 512      # pages are measured on a small grayscale sample
+
+
+
+
+
+
+def measure(image: Image.Image) -> Dict[str, float]:
+    """Ink coverage, marks, luminance spread and edge density of a rendered page."""
+    sample = image.convert("L")
+    sample.thumbnail((SAMPLE_PX, SAMPLE_PX))
+    pixel_count = (sample.width * sample.height) or 1
+
+    histogram = sample.histogram()
+    ink = sum(histogram[:INK_LEVEL]) / pixel_count
+    marks = sum(histogram[:MARK_LEVEL]) / pixel_count
+
+    stdev = ImageStat.Stat(sample).stddev[0]
+
+    # FIND_EDGES responds on the image border itself: drop a 1px frame
+    edge_image = sample.filter(ImageFilter.FIND_EDGES)
+    edge_image = edge_image.crop((1, 1, max(edge_image.width - 1, 2), max(edge_image.height - 1, 2)))
+    edge_histogram = edge_image.histogram()
+    edges = sum(edge_histogram[EDGE_LEVEL:]) / ((edge_image.width * edge_image.height) or 1)
+
+    return {"ink": ink, "marks": marks, "stdev": stdev, "edges": edges}
+
+
+def is_empty(stats: Dict[str, float]) -> bool:
+    """True for a page with nothing on it at all, safe to skip without OCR.
+    Needs the text_chars / images counts render_page() adds to the stats."""
+    if not BLANK_DETECTION:
+        return False
+    return (
+        stats.get("text_chars", 1) == 0
+        and stats.get("images", 1) == 0
+        and stats["marks"] <= BLANK_EMPTY_MAX_MARKS
+    )
+
+
+def is_blank(stats: Dict[str, float], page_text: str) -> bool:
+    """True only for obvious blank / separator pages (after OCR)."""
+    if not BLANK_DETECTION:
+        return False
+    return (
+        len(page_text.strip()) <= BLANK_MAX_CHARS
+        and stats["ink"] <= BLANK_MAX_INK
+        and stats["stdev"] <= BLANK_MAX_STDEV
+        and stats["edges"] <= BLANK_MAX_EDGES
+    )
+
+
+
+
+
+
+class BlankPageCounter:
+    """How many GPT classification (and Vision OCR) calls the local detector avoided."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.skipped = 0
+        self.skipped_before_ocr = 0
+        self.sent_to_gpt = 0
+
+    def record(self, skipped: bool, before_ocr: bool = False):
+        with self._lock:
+            if skipped:
+                self.skipped += 1
+                if before_ocr:
+                    self.skipped_before_ocr += 1
+            else:
+                self.sent_to_gpt += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"calls_avoided": self.skipped, "calls_sent": self.sent_to_gpt,
+                    "ocr_calls_avoided": self.skipped_before_ocr}
+
+
+
+
+
+
+blank_page_counter = BlankPageCounter()
@@ -0,0 +1,309 @@
+# backend/cache.py
+import hashlib, os, threading, time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+
+
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU, bounded by entry count and by total size.
+
+    `sizeof(value)` gives the size counted against max_bytes (0 = no byte bound).
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int = 0, sizeof: Callable[[Any], int] = len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self.sizeof(self._data.pop(key))
+            if self.max_entries <= 0 or (self.max_bytes and size > self.max_bytes):
+                return  # caching disabled, or a single value larger than the whole cache
+            self._data[key] = value
+            self._bytes += size
+            while len(self._data) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes):
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= self.sizeof(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+
+
+
+
+class EncryptedDiskStore:
+    """Optional disk tier: one Fernet-encrypted file per key, expired after `ttl` seconds.
+
+    Nothing is ever written in clear text; without a key the tier stays off.
+    """
+
+    def __init__(self, directory: str, key: str, ttl: int):
+        from cryptography.fernet import Fernet  # optional dependency, only for this tier
+
+        self.directory = directory
+        self.ttl = ttl
+        self._fernet = Fernet(key.encode() if isinstance(key, str) else key)
+        self._puts = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        from cryptography.fernet import InvalidToken
+
+        try:
+            with open(self._path(key), "rb") as f:
+                token = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            return self._fernet.decrypt(token, ttl=self.ttl or None)
+        except InvalidToken:
+            # Expired (or written with another key): drop it
+            self._remove(key)
+            return None
+
+    def put(self, key: str, value: bytes):
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self._fernet.encrypt(value))
+        os.replace(tmp_path, self._path(key))
+
+        with self._lock:
+            self._puts += 1
+            purge = self._puts % 256 == 0
+        if purge:
+            self.purge_expired()
+
+    def purge_expired(self):
+        if not self.ttl:
+            return
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            path = self._path(name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _remove(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+
+
+
+
+class OCRCache:
+    """Content-addressed cache of Vision OCR results, shared by every job.
+
+    Keys are derived from the PDF bytes, the page index and the render profile,
+    so a pièce uploaded again (or sent to /docresume after /summaries) is
+    recognised before its pages are even rendered.
+
+    Tiers: bounded in-memory LRU, plus an optional encrypted disk tier enabled
+    by OCR_CACHE_DIR + OCR_CACHE_KEY (a Fernet key), expiring after OCR_CACHE_TTL.
+    """
+
+    def __init__(self):
+        self.memory = LRUCache(
+            max_entries=int(os.getenv("OCR_CACHE_ENTRIES", "5000")),
+            max_bytes=int(os.getenv("OCR_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            sizeof=lambda text: len(text.encode("utf-8")),
+        )
+        self.disk: Optional[EncryptedDiskStore] = None
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory, key = os.getenv("OCR_CACHE_DIR"), os.getenv("OCR_CACHE_KEY")
+        if directory and not key:
+            print("OCR_CACHE_DIR is set without OCR_CACHE_KEY: on-disk OCR cache disabled")
+        elif directory:
+            self.disk = EncryptedDiskStore(directory, key, int(os.getenv("OCR_CACHE_TTL", str(7 * 24 * 3600))))
+
+    @staticmethod
+    def document_hash(pdf_content: bytes) -> str:
+        return hashlib.sha256(pdf_content).hexdigest()
+
+    @staticmethod
+    def page_key(document_hash: str, page_index: int, profile: str) -> str:
+        return hashlib.sha256(f"{document_hash}:{page_index}:{profile}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        text = self.memory.get(key)
+        if text is not None:
+            return text
+
+        if self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except OSError as e:
+                print(f"OCR disk cache read failed: {e}")
+                value = None
+            if value is not None:
+                text = value.decode("utf-8")
+                self.memory.put(key, text)
+                with self._lock:
+                    self.disk_hits += 1
+                return text
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, text: str):
+        self.memory.put(key, text)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, text.encode("utf-8"))
+            except OSError as e:
+                print(f"OCR disk cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        memory = self.memory.stats()
+        with self._lock:
+            return {
+                "memory_hits": memory["hits"],
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": memory["entries"],
+                "memory_bytes": memory["bytes"],
+                "evictions": memory["evictions"],
+                "disk_enabled": self.disk is not None,
+            }
+
+
+
+
+
+
+ocr_cache = OCRCache()
+
+
+
+
+
+
+class LLMResponseCache:
+    """Cache of deterministic (temperature 0) GPT answers.
+
+    Keyed on (model, template id, sha256 of the prompt, sha256 of the image,
+    image detail, temperature); bounded by LLM_CACHE_ENTRIES / LLM_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self):
+        self.memory = LRUCache(
+            max_entries=int(os.getenv("LLM_CACHE_ENTRIES", "10000")),
+            max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+            sizeof=lambda text: len(text.encode("utf-8")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory.max_entries > 0
+
+    @staticmethod
+    def key(model: str, template: Optional[str], prompt: str, image_base64: Optional[str] = None,
+            detail: Optional[str] = None, temperature: float = 0) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        image_hash = hashlib.sha256(image_base64.encode("ascii")).hexdigest() if image_base64 else "-"
+        return f"{model}|{template or '-'}|{prompt_hash}|{image_hash}|{detail or '-'}|{temperature}"
+
+    def get(self, key: str) -> Optional[str]:
+        return self.memory.get(key)
+
+    def put(self, key: str, text: str):
+        self.memory.put(key, text)
+
+    def stats(self) -> Dict[str, int]:
+        return self.memory.stats()
+
+
+
+
+
+
+llm_cache = LLMResponseCache()
+
+
+
+
+
+
+class DocxCache:
+    """Adobe DOCX exports, keyed on sha256 of the input PDF and the OCR language,
+    so a PDF converted again skips the whole Adobe round-trip.
+
+    In memory only (the DOCX holds the full document text); bounded by
+    DOCX_CACHE_ENTRIES / DOCX_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self):
+        self.memory = LRUCache(
+            max_entries=int(os.getenv("DOCX_CACHE_ENTRIES", "200")),
+            max_bytes=int(os.getenv("DOCX_CACHE_MAX_BYTES", str(128 * 1024 * 1024))),
+        )
+
+    @staticmethod
+    def key(pdf_content: bytes, ocr_lang: str) -> str:
+        return f"{hashlib.sha256(pdf_content).hexdigest()}|{ocr_lang}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.memory.get(key)
+
+    def put(self, key: str, docx: bytes):
+        self.memory.put(key, docx)
+
+    def stats(self) -> Dict[str, int]:
+        return self.memory.stats()
+
+
+
+
+
+
+docx_cache = DocxCache()
@@ -0,0 +1,160 @@
+# backend/chunking.py
+import os, re, threading, time
+from typing import Any, List, Optional
+
+from backend.llm_gateway import TEXT_MODEL, VISION_MODEL
+
+
+
+
+
+
+# Input budget (tokens) we allow per prompt, per model: context window minus
+# room for the answer. Override the default model budget with LLM_INPUT_BUDGET.
+MODEL_INPUT_BUDGETS = {
+    TEXT_MODEL: int(os.getenv("LLM_INPUT_BUDGET", "110000")),   # 128k context, ≤16k output
+    VISION_MODEL: int(os.getenv("LLM_INPUT_BUDGET", "110000")),  # 128k context
+}
+DEFAULT_INPUT_BUDGET = 8000
+
+# Used only if tiktoken (or its BPE file) is unavailable; French legal text
+# runs well under 4 characters per token, so stay on the safe side
+FALLBACK_CHARS_PER_TOKEN = 3
+
+# Sentence boundaries: whitespace after ., !, ? or … (optionally closed by a quote/parenthesis)
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s+|(?<=[.!?…]["»)\]])\s+')
+
+
+
+
+
+
+# After a failed tiktoken load, count with the heuristic for this long, then try again
+TIKTOKEN_RETRY_SECONDS = float(os.getenv("TIKTOKEN_RETRY_SECONDS", "300"))
+
+_encoders = {}          # model -> tiktoken encoding
+_encoder_attempts = {}  # model -> time.monotonic() of the last load started without success
+_encoders_lock = threading.Lock()
+
+
+def _load_encoder(model: str) -> Any:
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def _get_encoder(model: str) -> Optional[Any]:
+    encoding = _encoders.get(model)
+    if encoding is not None:
+        return encoding
+    with _encoders_lock:
+        attempted_at = _encoder_attempts.get(model)
+        if attempted_at is not None and time.monotonic() - attempted_at < TIKTOKEN_RETRY_SECONDS:
+            return None  # failed recently, or another thread is loading it right now
+        _encoder_attempts[model] = time.monotonic()
+
+    # The first load may download the BPE file: never under the lock
+    try:
+        encoding = _load_encoder(model)
+    except Exception as e:
+        # Not installed, or the BPE file can't be downloaded: heuristic until the next attempt
+        print(f"tiktoken unavailable for {model} ({e}); counting {FALLBACK_CHARS_PER_TOKEN} chars per token, "
+              f"retrying in {TIKTOKEN_RETRY_SECONDS:g} s")
+        return None
+
+    with _encoders_lock:
+        _encoders[model] = encoding
+        _encoder_attempts.pop(model, None)
+    return encoding
+
+
+def count_tokens(text: str, model: str = TEXT_MODEL) -> int:
+    encoder = _get_encoder(model)
+    if encoder is None:
+        return -(-len(text) // FALLBACK_CHARS_PER_TOKEN)
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def input_budget(model: str = TEXT_MODEL, template: str = "") -> int:
+    """Tokens left for the variable part of a prompt built from `template`."""
+    budget = MODEL_INPUT_BUDGETS.get(model, DEFAULT_INPUT_BUDGET)
+    return max(budget - count_tokens(template, model), 1)
+
+
+def fits(text: str, max_tokens: int, model: str = TEXT_MODEL) -> bool:
+    return count_tokens(text, model) <= max_tokens
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = TEXT_MODEL) -> str:
+    """First max_tokens tokens of text (cut on a sentence boundary when possible)."""
+    if fits(text, max_tokens, model):
+        return text
+    return split_text(text, max_tokens, model=model)[0]
+
+
+
+
+
+
+def _split_units(text: str, max_tokens: int, model: str) -> List[str]:
+    """Paragraphs; paragraphs too long become sentences; sentences too long are hard-cut."""
+    units = []
+    for paragraph in (p for p in text.split('\n') if p.strip()):
+        if count_tokens(paragraph, model) <= max_tokens:
+            units.append(paragraph)
+            continue
+        for sentence in (s for s in SENTENCE_END.split(paragraph) if s.strip()):
+            if count_tokens(sentence, model) <= max_tokens:
+                units.append(sentence)
+            else:
+                units.extend(_hard_split(sentence, max_tokens, model))
+    return units
+
+
+def _hard_split(text: str, max_tokens: int, model: str) -> List[str]:
+    encoder = _get_encoder(model)
+    if encoder is None:
+        size = max_tokens * FALLBACK_CHARS_PER_TOKEN
+        return [text[i:i + size] for i in range(0, len(text), size)]
+    tokens = encoder.encode(text, disallowed_special=())
+    return [encoder.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+
+def split_text(text: str, max_tokens: int, overlap_tokens: int = 0,
+               model: str = TEXT_MODEL, joiner: str = '\n\n') -> List[str]:
+    """
+    Split text into chunks of at most max_tokens tokens, packing whole
+    paragraphs (then whole sentences) per chunk. Each chunk after the first
+    starts with the trailing units of the previous one, up to overlap_tokens.
+    """
+    joiner_tokens = count_tokens(joiner, model)
+
+    def size(items):
+        return sum(tokens for _, tokens in items) + joiner_tokens * max(len(items) - 1, 0)
+
+    chunks = []
+    current, current_size = [], 0
+
+    for unit in _split_units(text, max_tokens, model):
+        item = (unit, count_tokens(unit, model))
+        if current and current_size + joiner_tokens + item[1] > max_tokens:
+            chunks.append(joiner.join(u for u, _ in current))
+
+            # Carry the tail of the previous chunk over as context
+            carried = []
+            for previous in reversed(current):
+                candidate = [previous] + carried
+                if size(candidate) > overlap_tokens or size(candidate + [item]) > max_tokens:
+                    break
+                carried = candidate
+            current, current_size = carried, size(carried)
+
+        current_size = current_size + joiner_tokens + item[1] if current else item[1]
+        current.append(item)
+
+    if current:
+        chunks.append(joiner.join(u for u, _ in current))
+    return chunks
@@ -0,0 +1,262 @@
+# backend/docx_engine.py
+import io, os
+from collections import Counter
+from contextlib import nullcontext
+from typing import Any, ContextManager, Dict, List, Optional, Tuple
+
+import fitz
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.shared import Emu, Pt
+
+from backend.text_layer import (NATIVE_MAX_IMAGE_COVERAGE, NATIVE_MIN_CHARS, NATIVE_MIN_GLYPH_RATIO,
+                                glyph_ratio, image_coverage)
+
+
+
+
+# Convert born-digital PDFs in-process (PyMuPDF layout → python-docx) and only
+# send scans / complex layouts to Adobe
+LOCAL_DOCX_ENGINE = os.getenv("LOCAL_DOCX_ENGINE", "1") != "0"
+LOCAL_DOCX_MAX_PAGES = int(os.getenv("LOCAL_DOCX_MAX_PAGES", "300"))
+
+# Share of a page's text lines sitting side by side with another block
+# (outside tables) above which the page is treated as multi-column
+MULTI_COLUMN_RATIO = 0.3
+
+# A line is a heading when its font is this much larger than the body text
+HEADING_SIZE_RATIO = 1.15
+HEADING_MAX_CHARS = 200
+
+
+
+
+
+
+# -----------------------------
+# PDF → layout (fitz, run under the caller's fitz lock)
+# -----------------------------
+def _table_of(block_rect: fitz.Rect, tables: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    center = (block_rect.tl + block_rect.br) / 2
+    for table in tables:
+        if center in table["rect"]:
+            return table
+    return None
+
+
+def _is_multi_column(rects: List[fitz.Rect]) -> bool:
+    if len(rects) < 4:
+        return False
+    side_by_side = 0
+    for rect in rects:
+        for other in rects:
+            if other is rect:
+                continue
+            overlap_y = min(rect.y1, other.y1) - max(rect.y0, other.y0)
+            if overlap_y > 0.5 * min(rect.height, other.height) and (rect.x1 <= other.x0 or other.x1 <= rect.x0):
+                side_by_side += 1
+                break
+    return side_by_side / len(rects) > MULTI_COLUMN_RATIO
+
+
+def _alignment(rect: fitz.Rect, page_rect: fitz.Rect, left_margin: float) -> str:
+    """Indented blocks centred on the page are centred; blocks hugging the right edge are right-aligned."""
+    width = page_rect.width
+    indented = rect.x0 - left_margin > 0.1 * width
+    if indented and abs((rect.x0 + rect.x1) / 2 - width / 2) < 0.05 * width:
+        return "center"
+    if rect.x0 > width / 2 and page_rect.x1 - rect.x1 < 0.15 * width:
+        return "right"
+    return "left"
+
+
+def _paragraph(block: Dict[str, Any], page_rect: fitz.Rect, left_margin: float) -> Optional[Dict[str, Any]]:
+    """One text block → {"runs": [(text, size, bold, italic, superscript)], "align", "size"}."""
+    runs: List[List[Any]] = []
+    for line_index, line in enumerate(block["lines"]):
+        if line_index and runs:
+            # Join wrapped lines; keep hyphenated words whole
+            if runs[-1][0].endswith("-") and not runs[-1][0].endswith(" -"):
+                runs[-1][0] = runs[-1][0][:-1]
+            elif not runs[-1][0].endswith(" "):
+                runs[-1][0] += " "
+        for span in line["spans"]:
+            text = span["text"]
+            if not text:
+                continue
+            style = (round(span["size"] * 2) / 2, bool(span["flags"] & fitz.TEXT_FONT_BOLD)
+                     or "bold" in span["font"].lower(), bool(span["flags"] & fitz.TEXT_FONT_ITALIC)
+                     or "italic" in span["font"].lower() or "oblique" in span["font"].lower(),
+                     bool(span["flags"] & fitz.TEXT_FONT_SUPERSCRIPT))
+            if runs and tuple(runs[-1][1:]) == style:
+                runs[-1][0] += text
+            else:
+                runs.append([text, *style])
+
+    text = "".join(run[0] for run in runs).strip()
+    if not text:
+        return None
+    sizes = Counter()
+    for run in runs:
+        sizes[run[1]] += len(run[0])
+    return {
+        "kind": "paragraph",
+        "y": block["bbox"][1],
+        "runs": [tuple(run) for run in runs],
+        "text": text,
+        "size": sizes.most_common(1)[0][0],
+        "align": _alignment(fitz.Rect(block["bbox"]), page_rect, left_margin),
+    }
+
+
+def _read_page(page: fitz.Page) -> Optional[Tuple[fitz.Rect, List[Dict[str, Any]], List[Dict[str, Any]], int]]:
+    """The PyMuPDF part of extract_layout for one page: (page rect, tables, text
+    dict blocks, non-blank characters), or None when the page rules out a
+    local conversion."""
+    if image_coverage(page) > NATIVE_MAX_IMAGE_COVERAGE:
+        return None
+    text = page.get_text()
+    chars = sum(1 for c in text if not c.isspace())
+    drawings = page.get_cdrawings()
+    if not chars and (drawings or page.get_image_info()):
+        return None  # graphics without a text layer: small scans, outlined text, plans → Adobe OCR
+    if chars and glyph_ratio(text) < NATIVE_MIN_GLYPH_RATIO:
+        return None
+
+    tables = []
+    # Table detection needs ruling lines and is by far the slowest step: skip pages without vectors
+    for table in page.find_tables().tables if drawings else []:
+        rows = [[(cell or "").strip() for cell in row] for row in table.extract()]
+        if rows and max(len(row) for row in rows) > 1:
+            tables.append({"kind": "table", "y": table.bbox[1], "rect": fitz.Rect(table.bbox), "rows": rows})
+
+    blocks = page.get_text("dict", flags=fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_LIGATURES)["blocks"]
+    return fitz.Rect(page.rect), tables, blocks, chars
+
+
+def extract_layout(pdf_document: fitz.Document,
+                   lock: ContextManager[Any] = nullcontext()) -> Optional[List[Dict[str, Any]]]:
+    """{"width", "height", "items"} per page, items being the paragraphs, tables
+    and images of the page in reading order. None when the document should go
+    to Adobe instead (scans, pages of graphics without text, too little text
+    overall, broken text encodings, multi-column or rotated text, too many
+    pages).
+    PyMuPDF is only called under `lock` (the caller's fitz lock), taken one
+    page at a time so other jobs' pages get through between two pages.
+    """
+    with lock:
+        page_count = len(pdf_document)
+    if not LOCAL_DOCX_ENGINE or page_count > LOCAL_DOCX_MAX_PAGES:
+        return None
+
+    pages = []
+    total_chars = 0
+    for page_index in range(page_count):
+        with lock:
+            page_data = _read_page(pdf_document[page_index])
+        if page_data is None:
+            return None
+        page_rect, tables, blocks, chars = page_data
+        total_chars += chars
+        left_margin = min((block["bbox"][0] for block in blocks if block["type"] == 0), default=page_rect.x0)
+
+        items: List[Dict[str, Any]] = list(tables)
+        flow_rects = []
+        for block in blocks:
+            rect = fitz.Rect(block["bbox"])
+            if block["type"] == 1:
+                if rect.width > 4 and rect.height > 4:
+                    items.append({"kind": "image", "y": rect.y0, "width": rect.width,
+                                  "image": block["image"], "align": _alignment(rect, page_rect, left_margin)})
+                continue
+            if _table_of(rect, tables):
+                continue
+            if any(line["dir"] != (1.0, 0.0) for line in block["lines"]):
+                return None
+            paragraph = _paragraph(block, page_rect, left_margin)
+            if paragraph:
+                items.append(paragraph)
+                flow_rects.append(rect)
+
+        if _is_multi_column(flow_rects):
+            return None
+        pages.append({"width": page_rect.width, "height": page_rect.height,
+                      "items": sorted(items, key=lambda item: item["y"])})
+
+    # Too little text for a born-digital document: let Adobe OCR it rather than ship an empty DOCX
+    if total_chars < NATIVE_MIN_CHARS * page_count:
+        return None
+    return pages
+
+
+
+
+
+
+# -----------------------------
+# Layout → DOCX (pure python-docx, no lock needed)
+# -----------------------------
+ALIGNMENTS = {"left": WD_ALIGN_PARAGRAPH.LEFT, "center": WD_ALIGN_PARAGRAPH.CENTER,
+              "right": WD_ALIGN_PARAGRAPH.RIGHT}
+
+
+def _heading_levels(pages: List[Dict[str, Any]]) -> Dict[float, int]:
+    """Font size → heading level (1–3), relative to the dominant body size."""
+    body = Counter()
+    for page in pages:
+        for item in page["items"]:
+            if item["kind"] == "paragraph":
+                body[item["size"]] += len(item["text"])
+    if not body:
+        return {}
+    body_size = body.most_common(1)[0][0]
+    larger = sorted({size for size in body if size >= body_size * HEADING_SIZE_RATIO}, reverse=True)
+    return {size: min(level, 3) for level, size in enumerate(larger, 1)}
+
+
+def build_docx(pages: List[Dict[str, Any]]) -> io.BytesIO:
+    """DOCX with one page break per PDF page, on the paper size of the first page."""
+    document = Document()
+    levels = _heading_levels(pages)
+
+    section = document.sections[0]
+    if pages:
+        section.page_width, section.page_height = Pt(pages[0]["width"]), Pt(pages[0]["height"])
+    text_width = section.page_width - section.left_margin - section.right_margin
+
+    for page_index, page in enumerate(pages):
+        if page_index:
+            document.add_page_break()
+        for item in page["items"]:
+            if item["kind"] == "table":
+                columns = max(len(row) for row in item["rows"])
+                table = document.add_table(rows=len(item["rows"]), cols=columns)
+                table.style = "Table Grid"
+                for row, cells in zip(table.rows, item["rows"]):
+                    for cell, text in zip(row.cells, cells):
+                        cell.text = text
+                continue
+
+            if item["kind"] == "image":
+                try:
+                    document.add_picture(io.BytesIO(item["image"]), width=Emu(min(Pt(item["width"]), text_width)))
+                except Exception:
+                    continue  # image format python-docx can't embed
+                document.paragraphs[-1].alignment = ALIGNMENTS[item["align"]]
+                continue
+
+            level = levels.get(item["size"]) if len(item["text"]) <= HEADING_MAX_CHARS else None
+            paragraph = document.add_heading(level=level) if level else document.add_paragraph()
+            paragraph.alignment = ALIGNMENTS[item["align"]]
+            for text, size, bold, italic, superscript in item["runs"]:
+                run = paragraph.add_run(text)
+                if not level:
+                    run.font.size = Pt(size)
+                run.bold = bold or None
+                run.italic = italic or None
+                run.font.superscript = superscript or None
+
+    buffer = io.BytesIO()
+    document.save(buffer)
+    buffer.seek(0)
+    return buffer
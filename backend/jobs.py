@@ -1,43 +1,409 @@
 # backend/jobs.py
-import asyncio, json, uuid, time, threading, base64
-from typing import Dict, Any, List
+import asyncio, io, json, os, uuid, time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
 from fastapi import UploadFile
 
+from backend.adobe_export import AdobeExportError, adobe_exporter
+from backend.metrics import job_events, jobs_finished, stage_seconds
+from backend.results import result_store
+from backend.uploads import upload_store
+from backend.state import STATE_BACKEND, STATE_POLL_INTERVAL, SQLiteState, shared_state
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
 
 
 
 
 
 class JobStore:
+    """Per-job append-only SSE event log, with a bounded lifetime and size.
+
+    - every event gets a sequence number (1, 2, …) and is serialized once;
+      any number of subscribers read the same log from their own position,
+      so a second tab or a reconnect (Last-Event-ID) replays what it missed
+    - finished jobs are kept JOB_RETENTION_SECONDS after mark_done, then evicted
+      by the reaper (reap_finished_jobs)
+    - each log holds at most JOB_QUEUE_MAX_EVENTS events / JOB_QUEUE_MAX_BYTES
+      of JSON; past that, *progress* events are dropped (a later one supersedes
+      them anyway) while started/result/error/done are always appended
+    """
+
     def __init__(self):
-        self.queues: Dict[str, asyncio.Queue] = {}
+        # job_id -> [(seq, event name, JSON payload)], seq == index + 1
+        self.logs: Dict[str, List[Tuple[int, str, str]]] = {}
+        self.conditions: Dict[str, asyncio.Condition] = {}
         self.done: Dict[str, bool] = {}
+        self.log_bytes: Dict[str, int] = {}
+        self.finished_at: Dict[str, float] = {}
 
-    def create_job(self) -> str:
+        self.retention = float(os.getenv("JOB_RETENTION_SECONDS", "600"))
+        self.max_events = int(os.getenv("JOB_QUEUE_MAX_EVENTS", "1000"))
+        self.max_bytes = int(os.getenv("JOB_QUEUE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+        self.evicted_jobs = 0
+        self.dropped_events = 0
+
+    async def create_job(self) -> str:
         job_id = uuid.uuid4().hex
-        self.queues[job_id] = asyncio.Queue()
+        self.logs[job_id] = []
+        self.conditions[job_id] = asyncio.Condition()
         self.done[job_id] = False
+        self.log_bytes[job_id] = 0
         return job_id
 
-    def exists(self, job_id: str) -> bool:
-        return job_id in self.queues
-
-    def get_queue(self, job_id: str) -> asyncio.Queue:
-        return self.queues[job_id]
+    async def exists(self, job_id: str) -> bool:
+        return job_id in self.logs
 
     async def push(self, job_id: str, data: Dict[str, Any]):
         # Always push JSON-serializable dicts
-        await self.queues[job_id].put(data)
+        if job_id not in self.logs:
+            return  # evicted while the job was still reporting
+        payload = json.dumps(data, ensure_ascii=False)
+        log = self.logs[job_id]
+        event = data.get("event", "")
+        if event == "progress" and (
+            len(log) >= self.max_events or self.log_bytes[job_id] + len(payload) > self.max_bytes
+        ):
+            self.dropped_events += 1
+            return
+        self.log_bytes[job_id] += len(payload)
+        log.append((len(log) + 1, event, payload))
+        job_events.inc(event=event)
+
+        condition = self.conditions[job_id]
+        async with condition:
+            condition.notify_all()
+
+    async def wait_events(self, job_id: str, after: int, timeout: float) -> List[Tuple[int, str, str]]:
+        """Events with seq > after; waits up to `timeout` seconds for one (else [])."""
+        log = self.logs.get(job_id)
+        if log is None:
+            return []
+        if len(log) <= after:
+            condition = self.conditions[job_id]
+            try:
+                async with condition:
+                    await asyncio.wait_for(condition.wait_for(lambda: len(log) > after), timeout)
+            except asyncio.TimeoutError:
+                return []
+        return log[after:]
+
+    async def mark_done(self, job_id: str):
+        if job_id in self.done:
+            self.done[job_id] = True
+            self.finished_at[job_id] = time.time()
+
+    async def discard(self, job_id: str):
+        """Forget a job and free its log."""
+        if self.logs.pop(job_id, None) is not None:
+            self.evicted_jobs += 1
+        self.conditions.pop(job_id, None)
+        self.done.pop(job_id, None)
+        self.log_bytes.pop(job_id, None)
+        self.finished_at.pop(job_id, None)
+
+    async def evict_finished(self) -> List[str]:
+        """Drop jobs finished more than `retention` seconds ago."""
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, ts in self.finished_at.items() if ts < cutoff]
+        for job_id in expired:
+            await self.discard(job_id)
+        return expired
+
+    async def stats(self) -> Dict[str, int]:
+        finished = sum(1 for is_done in self.done.values() if is_done)
+        return {
+            "live_jobs": len(self.done) - finished,
+            "finished_jobs": finished,
+            "evicted_jobs": self.evicted_jobs,
+            "logged_events": sum(len(log) for log in self.logs.values()),
+            "logged_bytes": sum(self.log_bytes.values()),
+            "dropped_events": self.dropped_events,
+        }
+
+
+
+
+
+
+class SQLiteJobStore(JobStore):
+    """JobStore on the shared SQLite state (STATE_BACKEND=sqlite).
+
+    Same limits and event format; the log lives in the `events` table, so an
+    SSE stream on any worker sees events pushed by the worker running the job.
+    Subscribers poll the log every STATE_POLL_INTERVAL seconds. Every query
+    runs in a thread (asyncio.to_thread) so a busy database never blocks the
+    event loop.
+    """
+
+    def __init__(self, state: SQLiteState):
+        super().__init__()
+        self.state = state
+
+    async def create_job(self) -> str:
+        return await asyncio.to_thread(self._create_job)
+
+    def _create_job(self) -> str:
+        job_id = uuid.uuid4().hex
+        self.state.execute("INSERT INTO jobs (job_id, created_at) VALUES (?, ?)", (job_id, time.time()))
+        return job_id
+
+    async def exists(self, job_id: str) -> bool:
+        row = await asyncio.to_thread(self.state.query_one, "SELECT 1 FROM jobs WHERE job_id = ?", (job_id,))
+        return row is not None
+
+    async def push(self, job_id: str, data: Dict[str, Any]):
+        payload = json.dumps(data, ensure_ascii=False)
+        event = data.get("event", "")
+        if await asyncio.to_thread(self._append, job_id, event, payload):
+            job_events.inc(event=event)
+
+    def _append(self, job_id: str, event: str, payload: str) -> bool:
+        """Append one event unless the limits drop it; True if it was logged."""
+        with self.state.transaction() as cursor:
+            row = cursor.execute(
+                "SELECT log_bytes, (SELECT COALESCE(MAX(seq), 0) FROM events WHERE job_id = ?) "
+                "FROM jobs WHERE job_id = ?", (job_id, job_id)
+            ).fetchone()
+            if row is None:
+                return False  # evicted while the job was still reporting
+            log_bytes, last_seq = row
+            if event == "progress" and (
+                last_seq >= self.max_events or log_bytes + len(payload) > self.max_bytes
+            ):
+                self.dropped_events += 1
+                return False
+            cursor.execute("INSERT INTO events (job_id, seq, event, payload) VALUES (?, ?, ?, ?)",
+                           (job_id, last_seq + 1, event, payload))
+            cursor.execute("UPDATE jobs SET log_bytes = log_bytes + ? WHERE job_id = ?", (len(payload), job_id))
+        return True
+
+    async def wait_events(self, job_id: str, after: int, timeout: float) -> List[Tuple[int, str, str]]:
+        deadline = time.time() + timeout
+        while True:
+            rows = await asyncio.to_thread(
+                self.state.query,
+                "SELECT seq, event, payload FROM events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after),
+            )
+            if rows or time.time() >= deadline:
+                return rows
+            await asyncio.sleep(STATE_POLL_INTERVAL)
+
+    async def mark_done(self, job_id: str):
+        await asyncio.to_thread(self.state.execute, "UPDATE jobs SET done = 1, finished_at = ? WHERE job_id = ?",
+                                (time.time(), job_id))
+
+    async def discard(self, job_id: str):
+        await asyncio.to_thread(self._discard, job_id)
+
+    def _discard(self, job_id: str):
+        with self.state.transaction() as cursor:
+            cursor.execute("DELETE FROM events WHERE job_id = ?", (job_id,))
+            if cursor.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,)).rowcount:
+                self.evicted_jobs += 1
+
+    async def evict_finished(self) -> List[str]:
+        return await asyncio.to_thread(self._evict_finished)
+
+    def _evict_finished(self) -> List[str]:
+        cutoff = time.time() - self.retention
+        expired = [row[0] for row in self.state.query(
+            "SELECT job_id FROM jobs WHERE done = 1 AND finished_at < ?", (cutoff,)
+        )]
+        for job_id in expired:
+            self._discard(job_id)
+        return expired
+
+    async def stats(self) -> Dict[str, int]:
+        return await asyncio.to_thread(self._stats)
+
+    def _stats(self) -> Dict[str, int]:
+        live, finished, log_bytes = self.state.query_one(
+            "SELECT COALESCE(SUM(done = 0), 0), COALESCE(SUM(done = 1), 0), COALESCE(SUM(log_bytes), 0) FROM jobs"
+        )
+        return {
+            "live_jobs": live,
+            "finished_jobs": finished,
+            "evicted_jobs": self.evicted_jobs,  # by this worker
+            "logged_events": self.state.query_one("SELECT COUNT(*) FROM events")[0],
+            "logged_bytes": log_bytes,
+            "dropped_events": self.dropped_events,  # by this worker
+        }
+
+
+
+
 
-    def mark_done(self, job_id: str):
-        self.done[job_id] = True
 
+job_store = SQLiteJobStore(shared_state()) if STATE_BACKEND == "sqlite" else JobStore()
 
+JOB_REAP_INTERVAL = 30
 
 
 
 
-job_store = JobStore()
+async def reap_finished_jobs():
+    """Background task: evict finished jobs once their retention window is over."""
+    while True:
+        await asyncio.sleep(JOB_REAP_INTERVAL)
+        await job_store.evict_finished()
+
+
+
+
+
+
+JobRunner = Callable[[str, List[Dict[str, Any]]], Awaitable[None]]
+
+
+def ordinal_fr(n: int) -> str:
+    return "1er" if n == 1 else f"{n}ème"
+
+
+class JobScheduler:
+    """Fixed pool of asyncio workers pulling committed jobs from an admission queue.
+
+    - at most JOB_WORKERS jobs run at once; waiting jobs get `queued` events
+      with their position ("vous êtes 3ème") whenever it changes
+    - two lanes: "interactive" (docresume, pdf2word) goes first, but once
+      JOB_BULK_STARVATION interactive jobs in a row have started while a bulk
+      (summaries) job waits, the bulk job is let through
+    - at most JOB_BULK_MAX_RUNNING bulk jobs run at once (default: all workers
+      but one), so long /summaries jobs never hold every worker and an
+      interactive job always finds one free
+    - within a lane, tenants (per-tenant API key, else X-Tenant; see
+      main.tenant_of) are served round-robin
+    - blocking work runs on `executor`, one thread per worker
+    """
+
+    LANES = ("interactive", "bulk")
+
+    def __init__(self):
+        self.workers = int(os.getenv("JOB_WORKERS", "4"))
+        self.starvation_limit = int(os.getenv("JOB_BULK_STARVATION", "3"))
+        self.bulk_max_running = max(1, min(self.workers - 1,
+                                           int(os.getenv("JOB_BULK_MAX_RUNNING", str(self.workers - 1)))))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+
+        # lane -> tenant -> waiting (job_id, runner, files, lane), tenants in round-robin order
+        self.lanes: Dict[str, "OrderedDict[str, deque]"] = {lane: OrderedDict() for lane in self.LANES}
+        self.interactive_streak = 0
+        self.running: Dict[str, str] = {}     # job_id -> runner name
+        self.bulk_running = 0
+        self.positions: Dict[str, int] = {}   # last position announced per waiting job
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        """Spawn the workers (from the running event loop, at app startup)."""
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def submit(self, job_id: str, runner: JobRunner, files: List[Dict[str, Any]],
+                     lane: str, tenant: str) -> int:
+        """Queue a job; returns its position in the admission order (1 = next)."""
+        self.lanes[lane].setdefault(tenant, deque()).append((job_id, runner, files, lane))
+        await self.announce_positions()
+        self._wakeup.set()
+        return self.positions.get(job_id, 0)
+
+    @staticmethod
+    def _pop(lanes: Dict[str, "OrderedDict[str, deque]"], streak: int, starvation_limit: int,
+             bulk_allowed: bool = True) -> Tuple[Optional[tuple], int]:
+        """Next job to start (mutates `lanes`) and the new interactive streak.
+        With `bulk_allowed` False (bulk capacity in use) only interactive jobs
+        are taken, and they don't count against the bulk job's starvation."""
+        interactive, bulk = lanes["interactive"], lanes["bulk"]
+        if not bulk_allowed:
+            if not interactive:
+                return None, streak
+            lane = interactive
+        elif interactive and (not bulk or streak < starvation_limit):
+            lane, streak = interactive, (streak + 1 if bulk else 0)
+        elif bulk:
+            lane, streak = bulk, 0
+        else:
+            return None, streak
+
+        tenant, waiting = next(iter(lane.items()))
+        item = waiting.popleft()
+        if waiting:
+            lane.move_to_end(tenant)  # next turn goes to the following tenant
+        else:
+            del lane[tenant]
+        return item, streak
+
+    def order(self) -> List[str]:
+        """job_ids in the order they would start if nothing else arrived."""
+        lanes = {lane: OrderedDict((tenant, deque(waiting)) for tenant, waiting in tenants.items())
+                 for lane, tenants in self.lanes.items()}
+        streak, order = self.interactive_streak, []
+        while True:
+            item, streak = self._pop(lanes, streak, self.starvation_limit)
+            if item is None:
+                return order
+            order.append(item[0])
+
+    async def announce_positions(self):
+        positions = {job_id: i + 1 for i, job_id in enumerate(self.order())}
+        for job_id, position in positions.items():
+            if self.positions.get(job_id) != position:
+                await job_store.push(job_id, {
+                    "event": "queued",
+                    "position": position,
+                    "msg": f"En attente… vous êtes {ordinal_fr(position)}",
+                })
+        self.positions = positions
+
+    async def _worker(self):
+        while True:
+            item, self.interactive_streak = self._pop(self.lanes, self.interactive_streak, self.starvation_limit,
+                                                      self.bulk_running < self.bulk_max_running)
+            if item is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            job_id, runner, files, lane = item
+            self.running[job_id] = runner.__name__
+            if lane == "bulk":
+                self.bulk_running += 1
+            try:
+                await self.announce_positions()
+                with stage_seconds.time(stage=f"job_{runner.__name__}"):
+                    await runner(job_id, files)
+                jobs_finished.inc(kind=runner.__name__)
+            except Exception as exc:
+                # Runners report their own errors; this only guards the worker
+                print(f"Job {job_id} crashed: {exc}")
+            finally:
+                self.running.pop(job_id, None)
+                if lane == "bulk":
+                    self.bulk_running -= 1
+                    self._wakeup.set()  # a worker idling on a capped bulk lane may take the next one
+                await upload_store.finish(job_id)  # the job's files no longer count against the upload quota
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": len(self.running),
+            "bulk_running": self.bulk_running,
+            "bulk_max_running": self.bulk_max_running,
+            "queued": {lane: sum(len(waiting) for waiting in tenants.values())
+                       for lane, tenants in self.lanes.items()},
+            "queued_tenants": {lane: len(tenants) for lane, tenants in self.lanes.items()},
+        }
+
+
+
+
+
+
+job_scheduler = JobScheduler()
 
 
 
@@ -70,6 +436,7 @@ async def start_processing(job_id: str, files: List[Dict[str, Any]]):
     """
     Run the sync progress generator and forward items to the SSE queue in real time.
     Keeps your original payload shape: 'pct'/'msg' for progress, 'result' for final data.
+    Each finished pièce is also sent as piece_result {position, piece, summary, bordereau, date, sources}.
     """
     from backend.app_logic import process_uploaded_files
 
@@ -81,7 +448,7 @@ async def start_processing(job_id: str, files: List[Dict[str, Any]]):
 
         # Cross-thread handoff queue
         q: asyncio.Queue = asyncio.Queue()
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
 
         def worker():
             """Run the synchronous generator and ship items to the asyncio queue."""
@@ -92,7 +459,8 @@ async def start_processing(job_id: str, files: List[Dict[str, Any]]):
             except Exception as e:
                 asyncio.run_coroutine_threadsafe(q.put({"__error__": str(e)}), loop)
 
-        threading.Thread(target=worker, daemon=True).start()
+        # Bounded pool shared by all running jobs (no thread per job)
+        loop.run_in_executor(job_scheduler.executor, worker)
 
         # Consume items as they arrive and forward to the SSE queue
         while True:
@@ -110,6 +478,10 @@ async def start_processing(job_id: str, files: List[Dict[str, Any]]):
                 await job_store.push(job_id, {"event": "progress", **item})
                 await asyncio.sleep(0)  # yield so StreamingResponse can flush now
 
+            elif "piece_result" in item:
+                await job_store.push(job_id, {"event": "piece_result", "data": item["piece_result"]})
+                await asyncio.sleep(0)
+
             elif "result" in item:
                 await job_store.push(job_id, {"event": "result", "data": item["result"]})
                 await asyncio.sleep(0)
@@ -120,12 +492,12 @@ async def start_processing(job_id: str, files: List[Dict[str, Any]]):
                 await asyncio.sleep(0)
 
         await job_store.push(job_id, {"event": "done", "ts": time.time()})
-        job_store.mark_done(job_id)
+        await job_store.mark_done(job_id)
 
     except Exception as exc:
         await job_store.push(job_id, {"event": "error", "detail": str(exc)})
         await job_store.push(job_id, {"event": "done"})
-        job_store.mark_done(job_id)
+        await job_store.mark_done(job_id)
 
 
 
@@ -138,10 +510,13 @@ async def start_processing(job_id: str, files: List[Dict[str, Any]]):
 async def start_pdf_to_word(job_id: str, files: List[Dict[str, Any]]):
     """
     Convert ONE uploaded PDF to DOCX and stream progress.
+    Digital PDFs are converted in-process; scans and complex layouts by Adobe.
     Emits:
-      started → progress (10 %, 85 %) → result (base64) → done
+      started → progress (10 %, 85 %) → result {filename, mime, size, url, token, engine} → done
+    `engine` is "local" or "adobe". The DOCX itself is downloaded from GET /jobs/{job_id}/result.
+    Adobe failures end with error {detail, reason} (see AdobeExportError).
     """
-    from backend.app_logic import convert_pdf_to_word
+    from backend.app_logic import convert_pdf_locally
 
     try:
         await job_store.push(job_id, {"event": "started", "ts": time.time()})
@@ -150,7 +525,7 @@ async def start_pdf_to_word(job_id: str, files: List[Dict[str, Any]]):
             await job_store.push(job_id, {"event": "error",
                                           "detail": "Exactly one PDF expected"})
             await job_store.push(job_id, {"event": "done"})
-            job_store.mark_done(job_id)
+            await job_store.mark_done(job_id)
             return
 
         upload = InMemoryUpload(files[0]["filename"], files[0]["content"])
@@ -159,40 +534,43 @@ async def start_pdf_to_word(job_id: str, files: List[Dict[str, Any]]):
                                       "msg": "Conversion en cours…"})
 
         loop = asyncio.get_running_loop()
-        word_buf = await loop.run_in_executor(
-            None, lambda: convert_pdf_to_word(upload)
-        )
-
-        if not word_buf:
-            await job_store.push(job_id, {"event": "error",
-                                          "detail": "Adobe API failed"})
-            await job_store.push(job_id, {"event": "done"})
-            job_store.mark_done(job_id)
-            return
+        engine = "local"
+        with stage_seconds.time(stage="local_docx"):
+            word_buf = await loop.run_in_executor(
+                job_scheduler.executor, lambda: convert_pdf_locally(upload)
+            )
+
+        if word_buf is None:
+            engine = "adobe"
+            try:
+                # Awaited on the exporter's loop: no thread is held while Adobe works
+                with stage_seconds.time(stage="adobe_export"):
+                    word_buf = io.BytesIO(await adobe_exporter.export(upload.getvalue()))
+            except AdobeExportError as exc:
+                await job_store.push(job_id, {"event": "error",
+                                              "detail": str(exc), "reason": exc.reason})
+                await job_store.push(job_id, {"event": "done"})
+                await job_store.mark_done(job_id)
+                return
 
         await job_store.push(job_id, {"event": "progress", "pct": 85,
-                                      "msg": "Encodage du DOCX…"})
+                                      "msg": "Préparation du DOCX…"})
 
-        import base64, os
-        b64 = base64.b64encode(word_buf.getvalue()).decode()
         out_name = os.path.splitext(upload.name)[0] + ".docx"
+        stored = await result_store.put(job_id, word_buf.getvalue(), out_name, DOCX_MIME)
 
         await job_store.push(job_id, {
             "event": "result",
-            "data": {
-                "filename": out_name,
-                "mime": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                "base64": b64
-            }
+            "data": {**stored, "engine": engine},
         })
 
         await job_store.push(job_id, {"event": "done", "ts": time.time()})
-        job_store.mark_done(job_id)
+        await job_store.mark_done(job_id)
 
     except Exception as exc:
         await job_store.push(job_id, {"event": "error", "detail": str(exc)})
         await job_store.push(job_id, {"event": "done"})
-        job_store.mark_done(job_id)
+        await job_store.mark_done(job_id)
 
 
 
@@ -207,7 +585,8 @@ async def start_doc_resume(job_id: str, files: List[Dict[str, Any]]):
     Generate a single-document résumé (PDF or Word) and stream progress.
 
     Emits:
-      started → progress (10 %, 85 %) → result {filename, mime, base64, text} → done
+      started → progress (10 %, one per summarised chunk, 85 %) → result {filename, mime, size, url, token, text} → done
+    The DOCX itself is downloaded from GET /jobs/{job_id}/result.
     """
     from backend.app_logic import (
         create_single_document_summary,
@@ -222,7 +601,7 @@ async def start_doc_resume(job_id: str, files: List[Dict[str, Any]]):
             await job_store.push(job_id, {"event": "error",
                                           "detail": "Exactly one document expected"})
             await job_store.push(job_id, {"event": "done"})
-            job_store.mark_done(job_id)
+            await job_store.mark_done(job_id)
             return
 
         upload = InMemoryUpload(files[0]["filename"], files[0]["content"])
@@ -230,44 +609,50 @@ async def start_doc_resume(job_id: str, files: List[Dict[str, Any]]):
         await job_store.push(job_id, {"event": "progress", "pct": 10,
                                       "msg": "Génération du résumé…"})
 
-        # Run blocking summariser in a thread pool
+        # Run blocking summariser in a thread pool; chunk progress is called
+        # from another thread, so hand it back to this loop
         loop = asyncio.get_running_loop()
+
+        def report(item: Dict[str, Any]):
+            asyncio.run_coroutine_threadsafe(
+                job_store.push(job_id, {"event": "progress", **item}), loop
+            )
+
         summary_text: str | None = await loop.run_in_executor(
-            None, lambda: create_single_document_summary(upload)
+            job_scheduler.executor, lambda: create_single_document_summary(upload, progress=report)
         )
 
         if not summary_text:
             await job_store.push(job_id, {"event": "error",
                                           "detail": "Résumé échoué"})
             await job_store.push(job_id, {"event": "done"})
-            job_store.mark_done(job_id)
+            await job_store.mark_done(job_id)
             return
 
         # Build a .docx version
-        word_buf = await loop.run_in_executor(
-            None, lambda: create_summary_word_document(summary_text, upload.name)
-        )
+        with stage_seconds.time(stage="docx_build"):
+            word_buf = await loop.run_in_executor(
+                job_scheduler.executor, lambda: create_summary_word_document(summary_text, upload.name)
+            )
 
         await job_store.push(job_id, {"event": "progress", "pct": 85,
-                                      "msg": "Encodage du DOCX…"})
+                                      "msg": "Préparation du DOCX…"})
 
-        b64 = base64.b64encode(word_buf.getvalue()).decode("ascii")
         out_name = (upload.name.rsplit(".", 1)[0] or "resume") + ".docx"
+        stored = await result_store.put(job_id, word_buf.getvalue(), out_name, DOCX_MIME)
 
         await job_store.push(job_id, {
             "event": "result",
             "data": {
-                "filename": out_name,
-                "mime": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                "base64": b64,
+                **stored,
                 "text": summary_text,
             }
         })
 
         await job_store.push(job_id, {"event": "done", "ts": time.time()})
-        job_store.mark_done(job_id)
+        await job_store.mark_done(job_id)
 
     except Exception as exc:
         await job_store.push(job_id, {"event": "error", "detail": str(exc)})
         await job_store.push(job_id, {"event": "done"})
-        job_store.mark_done(job_id)
+        await job_store.mark_done(job_id)
@@ -0,0 +1,202 @@
+# backend/llm_gateway.py
+import asyncio, os
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Coroutine, Dict, List, Optional
+
+import httpx
+
+from backend.cache import llm_cache
+from backend.loop_thread import LoopThread
+from backend.metrics import llm_calls, llm_retries, stage_seconds
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+
+
+
+
+
+# Use gpt-4o for image-related tasks, gpt-4o-mini for text-only tasks
+TEXT_MODEL = "gpt-4o-mini-2024-07-18"
+VISION_MODEL = "gpt-4o"
+
+
+
+
+
+
+class LLMGateway:
+    """Single entry point for every OpenAI chat call.
+
+    Owns one AsyncOpenAI client on one keep-alive httpx pool, driven by a
+    private event loop running in a daemon thread. In-flight calls are capped
+    by a semaphore, so hundreds of pending calls cost coroutines, not threads.
+
+    - async code (any event loop) awaits `text()` / `vision()`
+    - sync code (worker threads) uses `run(coro)` or `submit(coro)`
+
+    Point it at a local fake server with OPENAI_BASE_URL or `configure()`.
+
+    Temperature-0 calls are answered from `llm_cache` when the same
+    (model, template, prompt, image) was seen before; pass `cache=True/False`
+    to override that per call.
+    """
+
+    def __init__(self, **settings: Any):
+        self._loop_thread = LoopThread("llm-gateway")
+        self._client: Optional["AsyncOpenAI"] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._settings = settings
+
+    def _apply_settings(self, settings: Dict[str, Any]):
+        # Resolved when the client is built, i.e. after load_dotenv() has run
+        self.api_key = settings.get("api_key") or os.getenv("OPENAI_API_KEY")
+        self.base_url = settings.get("base_url") or os.getenv("OPENAI_BASE_URL")  # None → api.openai.com
+        self.max_concurrency = int(settings.get("max_concurrency") or os.getenv("LLM_MAX_CONCURRENCY", "64"))
+        self.max_connections = int(settings.get("max_connections") or os.getenv("LLM_MAX_CONNECTIONS", str(self.max_concurrency)))
+        self.max_retries = int(settings.get("max_retries", os.getenv("LLM_MAX_RETRIES", "2")))
+        self.timeout = float(settings.get("timeout") or os.getenv("LLM_TIMEOUT", "120"))
+
+    # -----------------------------
+    # Pooled client (on the gateway loop)
+    # -----------------------------
+    def _get_client(self) -> "AsyncOpenAI":
+        # Only ever called on the gateway loop, so no locking needed
+        if self._client is None:
+            from openai import AsyncOpenAI  # imported on first use: it's slow to load
+
+            self._apply_settings(self._settings)
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                timeout=self.timeout,
+                event_hooks={"request": [self._count_retry]},
+            )
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=http_client,
+                max_retries=self.max_retries,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    @staticmethod
+    async def _count_retry(request: httpx.Request):
+        # The OpenAI client numbers its attempts in this header (0 = first try)
+        if request.headers.get("x-stainless-retry-count", "0") != "0":
+            llm_retries.inc()
+
+    async def _chat(self, messages: List[Dict[str, Any]], model: str,
+                    temperature: float, timeout: Optional[float]) -> str:
+        client = self._get_client()
+        async with self._semaphore:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                timeout=timeout or self.timeout,
+            )
+        return response.choices[0].message.content.strip()
+
+    async def _cached_chat(self, cache_key: Optional[str], messages: List[Dict[str, Any]], model: str,
+                           temperature: float, timeout: Optional[float], template: Optional[str]) -> str:
+        template = template or "other"
+        if cache_key is not None:
+            cached = llm_cache.get(cache_key)
+            if cached is not None:
+                llm_calls.inc(template=template, outcome="cached")
+                return cached
+
+        try:
+            with stage_seconds.time(stage=f"gpt_{template}"):
+                result = await self._loop_thread.dispatch(self._chat(messages, model, temperature, timeout))
+        except Exception:
+            llm_calls.inc(template=template, outcome="error")
+            raise
+        llm_calls.inc(template=template, outcome="ok")
+
+        if cache_key is not None:
+            llm_cache.put(cache_key, result)
+        return result
+
+    @staticmethod
+    def _use_cache(cache: Optional[bool], temperature: float) -> bool:
+        # Only deterministic calls are cached unless the caller says otherwise
+        return llm_cache.enabled and (temperature == 0 if cache is None else cache)
+
+    # -----------------------------
+    # Public API
+    # -----------------------------
+    async def text(self, prompt: str, model: str = TEXT_MODEL, temperature: float = 0,
+                   timeout: Optional[float] = None, template: Optional[str] = None,
+                   cache: Optional[bool] = None) -> str:
+        """Text-only completion. Raises on API errors."""
+        messages = [{"role": "user", "content": prompt}]
+        cache_key = None
+        if self._use_cache(cache, temperature):
+            cache_key = llm_cache.key(model, template, prompt, temperature=temperature)
+        return await self._cached_chat(cache_key, messages, model, temperature, timeout, template)
+
+    async def vision(self, prompt: str, image_base64: str, model: str = VISION_MODEL,
+                     temperature: float = 0, detail: str = "high", mime: str = "image/png",
+                     timeout: Optional[float] = None, template: Optional[str] = None,
+                     cache: Optional[bool] = None) -> str:
+        """Completion on a prompt + one base64 image. Raises on API errors."""
+        messages = [{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {
+                    "url": f"data:{mime};base64,{image_base64}",
+                    "detail": detail,
+                }},
+            ],
+        }]
+        cache_key = None
+        if self._use_cache(cache, temperature):
+            cache_key = llm_cache.key(model, template, prompt, image_base64, detail, temperature)
+        return await self._cached_chat(cache_key, messages, model, temperature, timeout, template)
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Schedule `coro` on the gateway loop from sync code; returns a concurrent Future."""
+        return self._loop_thread.submit(coro)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None):
+        """Blocking bridge for worker threads. Never call it from a running event loop."""
+        return self._loop_thread.run(coro, timeout)
+
+    def warm_up(self):
+        """Start the gateway loop and build the pooled client now rather than on the first call."""
+        self.run(self._warm_up())
+
+    async def _warm_up(self):
+        self._get_client()
+
+    def configure(self, **settings: Any):
+        """Swap credentials / base_url / limits (e.g. a local fake server in tests).
+        The current pooled client is closed and rebuilt on the next call."""
+        self.run(self._reconfigure(settings))
+
+    async def _reconfigure(self, settings: Dict[str, Any]):
+        await self._close_client()
+        self._settings = settings
+
+    async def _close_client(self):
+        client, self._client = self._client, None
+        if client is not None:
+            await client.close()
+
+    def close(self):
+        """Close the pooled client and stop the gateway loop."""
+        self._loop_thread.stop(self._close_client())
+
+
+
+
+
+
+llm_gateway = LLMGateway()
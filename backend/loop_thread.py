@@ -0,0 +1,64 @@
+# backend/loop_thread.py
+import asyncio, threading
+from concurrent.futures import Future
+from typing import Coroutine, Optional
+
+
+
+
+
+
+class LoopThread:
+    """A private asyncio event loop running in a daemon thread, started on first use.
+
+    The HTTP clients of the LLM gateway and the Adobe exporter live on their
+    own loop, so their pools are shared by every caller:
+
+    - async code on any other loop awaits `dispatch(coro)`
+    - sync code (worker threads) uses `submit(coro)` or `run(coro)`
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name=self.name, daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    async def dispatch(self, coro: Coroutine):
+        """Run `coro` on the private loop and await it from whatever loop we're on."""
+        loop = self.loop()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Schedule `coro` on the private loop from sync code; returns a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop())
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None):
+        """Blocking bridge for worker threads. Never call it from a running event loop."""
+        return self.submit(coro).result(timeout)
+
+    def stop(self, cleanup: Optional[Coroutine] = None):
+        """Run `cleanup` on the loop if it was started, then stop the loop.
+        The next call starts a fresh one."""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            if cleanup is not None:
+                cleanup.close()
+            return
+        if cleanup is not None:
+            asyncio.run_coroutine_threadsafe(cleanup, loop).result()
+        loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,209 @@
+# backend/metrics.py
+import inspect, threading, time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, List, Tuple, Union
+
+
+
+
+# Latency buckets (seconds) shared by every stage: fast cache-sized work up to
+# multi-minute Adobe exports / long summaries
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+
+
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (key + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+
+
+
+
+class Counter:
+    """Monotonic count, per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Value that goes up and down, per label set."""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str):
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with _sum and _count, per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = STAGE_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket..., +Inf count, sum]
+        self._values: Dict[Labels, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = _labels(labels)
+        with self._lock:
+            row = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[len(self.buckets)] += 1
+            row[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the wall time of the `with` block (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        samples = []
+        with self._lock:
+            for labels, row in self._values.items():
+                for bound, count in zip(self.buckets, row):
+                    samples.append((f"{self.name}_bucket", labels + (("le", _format_value(bound)),), count))
+                samples.append((f"{self.name}_bucket", labels + (("le", "+Inf"),), row[len(self.buckets)]))
+                samples.append((f"{self.name}_sum", labels, row[-1]))
+                samples.append((f"{self.name}_count", labels, row[len(self.buckets)]))
+        return samples
+
+
+
+
+
+
+# A collector reads values owned elsewhere (stats() of the stores and caches)
+# at scrape time: returns, or is a coroutine returning, (name, kind, help,
+# [(labels dict, value)]) families
+Families = List[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]
+Collector = Callable[[], Union[Families, Awaitable[Families]]]
+
+
+class MetricsRegistry:
+    """Process-wide metrics, rendered in the Prometheus text format by /metrics.
+
+    With several uvicorn workers each process has its own registry; scrape
+    them individually or aggregate (sum) in Prometheus.
+    """
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._register(Gauge(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = STAGE_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    async def render(self) -> str:
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for collector in collectors:
+            try:
+                families = collector()
+                if inspect.isawaitable(families):
+                    families = await families
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(_labels(labels))} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+
+
+
+
+registry = MetricsRegistry()
+
+# Per-stage latency: render, ocr, gpt_<template>, chrono_sort, docx_build,
+# local_docx, adobe_export, and job_<runner> for whole jobs
+stage_seconds = registry.histogram("ia_stage_duration_seconds", "Wall time of one pipeline stage call.")
+llm_calls = registry.counter("ia_llm_calls_total", "GPT calls by template and outcome (ok, error, cached).")
+llm_retries = registry.counter("ia_llm_retries_total", "HTTP retries made by the OpenAI client.")
+pages_processed = registry.counter("ia_pages_total", "PDF pages read, by source (text_layer, ocr_cache, ocr, blank).")
+ocr_calls = registry.counter("ia_ocr_calls_total", "Google Vision OCR calls by outcome.")
+uploaded_bytes = registry.counter("ia_uploaded_bytes_total", "Bytes received on /uploads/batch.")
+uploaded_files = registry.counter("ia_uploaded_files_total", "Files received on /uploads/batch.")
+jobs_finished = registry.counter("ia_jobs_finished_total", "Jobs run to the end by the scheduler, by kind.")
+job_events = registry.counter("ia_job_events_total", "Events appended to job logs, by event (error = failed job).")
+sse_connections = registry.gauge("ia_sse_connections", "Open SSE streams.")
+adobe_exports = registry.counter("ia_adobe_exports_total", "Adobe DOCX exports by outcome (ok, cached, shared, or failure reason).")
+adobe_retries = registry.counter("ia_adobe_retries_total", "Adobe API calls retried after backoff, by HTTP status (or network).")
+provider_clients = registry.counter("ia_provider_clients_total", "Provider clients built, by provider (>1 = reconnects).")
@@ -0,0 +1,150 @@
+# backend/providers.py
+import os, threading
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, Type
+
+from backend.metrics import provider_clients
+
+
+
+
+# "1" builds every provider client (and imports its SDK) in a background
+# thread at startup instead of on the first job
+PROVIDER_WARMUP = os.getenv("PROVIDER_WARMUP", "0") == "1"
+
+
+
+
+
+
+class Provider:
+    """One shared, lazily built client for a paid API.
+
+    `factory()` imports the SDK and builds the client on first `get()`; every
+    job then reuses it (the underlying gRPC / HTTP clients are thread-safe).
+    After a failure that looks like a broken connection or expired auth,
+    `invalidate(client)` drops it and the next `get()` builds a fresh one.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any],
+                 transient: Callable[[], Tuple[Type[BaseException], ...]] = tuple):
+        self.name = name
+        self._factory = factory
+        self._transient = transient
+        self._client: Optional[Any] = None
+        self._lock = threading.Lock()
+        self.built = 0
+        self.invalidated = 0
+
+    def get(self) -> Any:
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is None:
+                self._client = self._factory()
+                self.built += 1
+                provider_clients.inc(provider=self.name)
+            return self._client
+
+    def invalidate(self, client: Any = None):
+        """Drop the shared client; with `client`, only if it is still the current one
+        (so a late failure on an old client doesn't throw away a fresh reconnect)."""
+        with self._lock:
+            if self._client is not None and (client is None or self._client is client):
+                self._client = None
+                self.invalidated += 1
+
+    def is_transient(self, exc: BaseException) -> bool:
+        """True for errors worth one retry on a rebuilt client."""
+        try:
+            return isinstance(exc, self._transient())
+        except ImportError:
+            return False
+
+    def override(self, factory: Callable[[], Any]):
+        """Swap the factory (a local fake in benchmarks / tests) and drop the current client."""
+        with self._lock:
+            self._factory = factory
+            self._client = None
+
+
+
+
+
+
+# -----------------------------
+# Factories: the SDK imports live here so importing app_logic stays cheap
+# -----------------------------
+def _vision_client():
+    from google.cloud import vision
+
+    return vision.ImageAnnotatorClient()
+
+
+def _vision_transient():
+    from google.api_core import exceptions
+
+    return (exceptions.ServiceUnavailable, exceptions.Unauthenticated, exceptions.DeadlineExceeded)
+
+
+def _adobe_client():
+    from backend.adobe_export import adobe_exporter
+
+    adobe_exporter.warm_up()
+    return adobe_exporter
+
+
+def _openai_client():
+    from backend.llm_gateway import llm_gateway
+
+    llm_gateway.warm_up()
+    return llm_gateway
+
+
+
+
+
+
+class ProviderRegistry:
+    """Named providers: vision (Google OCR), adobe (the PDF Services exporter), openai (the LLM gateway)."""
+
+    def __init__(self):
+        self._providers: Dict[str, Provider] = {}
+
+    def register(self, provider: Provider) -> Provider:
+        self._providers[provider.name] = provider
+        return provider
+
+    def __getitem__(self, name: str) -> Provider:
+        return self._providers[name]
+
+    def warm_up(self, names: Optional[Iterable[str]] = None):
+        """Build the clients now (blocking); failures are logged and retried on first use."""
+        for name in names or list(self._providers):
+            try:
+                self._providers[name].get()
+            except Exception as e:
+                print(f"Warm-up of provider {name} failed: {e}")
+        # Job code imports app_logic lazily; pay that import here too
+        import backend.app_logic  # noqa: F401
+
+    def start_warm_up(self):
+        if PROVIDER_WARMUP:
+            threading.Thread(target=self.warm_up, name="provider-warmup", daemon=True).start()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {"ready": provider._client is not None, "built": provider.built,
+                   "invalidated": provider.invalidated}
+            for name, provider in self._providers.items()
+        }
+
+
+
+
+
+
+providers = ProviderRegistry()
+vision_provider = providers.register(Provider("vision", _vision_client, _vision_transient))
+adobe_provider = providers.register(Provider("adobe", _adobe_client))
+openai_provider = providers.register(Provider("openai", _openai_client))
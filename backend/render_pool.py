@@ -0,0 +1,117 @@
+# backend/render_pool.py
+import multiprocessing, os, tempfile, threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
+import fitz
+
+from backend.rendering import RENDER_PROFILE, render_page
+
+
+
+
+# Rasterise pages in worker processes instead of threads (off by default).
+# The PDF is written once to a temp file (in /dev/shm when available, i.e. RAM)
+# that each worker opens by path and keeps open: no per-page pickling of the PDF.
+RENDER_POOL = os.getenv("RENDER_POOL", "0") == "1"
+RENDER_POOL_SIZE = max(1, int(os.getenv("RENDER_POOL_SIZE", str(os.cpu_count() or 1))))
+RENDER_POOL_DIR = os.getenv("RENDER_POOL_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+
+WORKER_OPEN_DOCUMENTS = 8  # documents kept open per worker process
+
+
+
+
+
+
+# --- worker side ---
+
+_documents: "OrderedDict[str, fitz.Document]" = OrderedDict()
+
+
+def _close_deleted_documents():
+    """Close documents whose job is over (PooledDocument.close() removed the file):
+    an open handle would keep the deleted file's RAM in /dev/shm."""
+    for path in [path for path in _documents if not os.path.exists(path)]:
+        _documents.pop(path).close()
+
+
+def _open_document(path: str) -> fitz.Document:
+    _close_deleted_documents()
+    document = _documents.get(path)
+    if document is None:
+        document = fitz.open(path)
+        _documents[path] = document
+        while len(_documents) > WORKER_OPEN_DOCUMENTS:
+            _documents.popitem(last=False)[1].close()
+    else:
+        _documents.move_to_end(path)
+    return document
+
+
+def _render_in_worker(path: str, page_index: int, profile_name: str) -> Dict[str, Any]:
+    return render_page(_open_document(path)[page_index], profile_name)
+
+
+
+
+
+
+# --- job side ---
+
+class PooledDocument:
+    """A PDF shared with the render workers through a temp file, for the time of one job."""
+
+    def __init__(self, pool: "RenderPool", pdf_content: bytes):
+        self.pool = pool
+        fd, self.path = tempfile.mkstemp(prefix="render-", suffix=".pdf", dir=RENDER_POOL_DIR)
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf_content)
+
+    def render(self, page_index: int, profile_name: Optional[str] = None) -> Future:
+        """Future of the render_page() dict for one page."""
+        return self.pool.executor().submit(_render_in_worker, self.path, page_index,
+                                           profile_name or RENDER_PROFILE)
+
+    def close(self):
+        # Each worker closes its handle on its next render (_close_deleted_documents)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class RenderPool:
+    """Process pool of RENDER_POOL_SIZE workers shared by every job, started on first use."""
+
+    def __init__(self, enabled: bool, size: int):
+        self.enabled = enabled
+        self.size = size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: don't fork a process that runs threads and an event loop
+                self._executor = ProcessPoolExecutor(max_workers=self.size,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def open(self, pdf_content: bytes) -> Optional[PooledDocument]:
+        """A PooledDocument to render from, or None when the pool is disabled."""
+        return PooledDocument(self, pdf_content) if self.enabled else None
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+
+
+
+
+render_pool = RenderPool(RENDER_POOL, RENDER_POOL_SIZE)
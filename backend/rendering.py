@@ -0,0 +1,110 @@
+# backend/rendering.py
+import base64, io, os
+from typing import Any, Dict, Optional
+
+import fitz
+from PIL import Image
+
+from backend.blank_pages import measure
+
+
+
+
+
+
+# Render profiles for the page images sent to Vision OCR and to GPT.
+#   max_dpi / min_dpi / max_side_px : DPI adapts to the page size so that the
+#                                     longest side stays under max_side_px
+#   gray                            : render in grayscale (1 byte per pixel)
+#   format / jpeg_quality           : encoding of the OCR / description image
+#   thumb_px                        : longest side of the classification
+#                                     thumbnail (0 = reuse the full image)
+RENDER_PROFILES: Dict[str, Dict[str, Any]] = {
+    # Original behaviour: 300 DPI colour PNG, same image for everything
+    "legacy": {"max_dpi": 300, "min_dpi": 300, "max_side_px": 0, "gray": False,
+               "format": "png", "jpeg_quality": 0, "thumb_px": 0},
+    # Colour JPEG, adaptive DPI, small thumbnail for classification
+    "balanced": {"max_dpi": 300, "min_dpi": 150, "max_side_px": 3500, "gray": False,
+                 "format": "jpeg", "jpeg_quality": 85, "thumb_px": 768},
+    # Grayscale JPEG: smallest payloads, for text-heavy scanned dossiers
+    "compact": {"max_dpi": 300, "min_dpi": 150, "max_side_px": 3000, "gray": True,
+                "format": "jpeg", "jpeg_quality": 80, "thumb_px": 512},
+}
+
+RENDER_PROFILE = os.getenv("RENDER_PROFILE", "balanced")
+
+MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg"}
+
+
+
+
+
+
+def get_profile(name: Optional[str] = None) -> Dict[str, Any]:
+    name = name or RENDER_PROFILE
+    if name not in RENDER_PROFILES:
+        raise ValueError(f"Unknown render profile {name!r} (expected one of {sorted(RENDER_PROFILES)})")
+    return RENDER_PROFILES[name]
+
+
+def choose_dpi(page: fitz.Page, profile: Dict[str, Any]) -> int:
+    """Highest DPI ≤ max_dpi keeping the longest side under max_side_px (but ≥ min_dpi)."""
+    dpi = profile["max_dpi"]
+    if profile["max_side_px"]:
+        longest_side_pt = max(page.rect.width, page.rect.height) or 1
+        dpi = min(dpi, int(profile["max_side_px"] * 72 / longest_side_pt))
+    return max(dpi, profile["min_dpi"])
+
+
+def pixmap_to_image(pix: fitz.Pixmap) -> Image.Image:
+    """Wrap a pixmap's samples in a Pillow image (no re-rendering)."""
+    mode = "L" if pix.n == 1 else "RGB"
+    return Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+
+
+def render_page(page: fitz.Page, profile_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Render a page ONCE and encode every payload we need from that pixmap:
+      image_bytes / image_mime             → Vision OCR and GPT image description
+      thumb_base64 / thumb_mime / thumb_detail → GPT TEXT/IMAGE/SKIP classification
+      page_stats                           → local blank-page detection
+    Must be called under the caller's fitz lock.
+    """
+    profile = get_profile(profile_name)
+    dpi = choose_dpi(page, profile)
+    colorspace = fitz.csGRAY if profile["gray"] else fitz.csRGB
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), colorspace=colorspace)
+
+    if profile["format"] == "jpeg":
+        image_bytes = pix.tobytes("jpeg", jpg_quality=profile["jpeg_quality"])
+    else:
+        image_bytes = pix.tobytes()
+    image_mime = MIME_TYPES[profile["format"]]
+
+    image = pixmap_to_image(pix)
+    page_stats = measure(image)
+    # What the page is made of, for the pre-OCR empty-page check
+    page_stats["text_chars"] = sum(1 for c in page.get_text() if not c.isspace())
+    page_stats["images"] = len(page.get_image_info())
+
+    if profile["thumb_px"]:
+        # Downscaled copy of the same pixmap; "low" detail is plenty for a 3-way label
+        thumb = image.copy()
+        thumb.thumbnail((profile["thumb_px"], profile["thumb_px"]))
+        buf = io.BytesIO()
+        thumb.save(buf, format="JPEG", quality=80)
+        thumb_base64 = base64.b64encode(buf.getvalue()).decode("utf-8")
+        thumb_mime, thumb_detail = "image/jpeg", "low"
+    else:
+        thumb_base64 = base64.b64encode(image_bytes).decode("utf-8")
+        thumb_mime, thumb_detail = image_mime, "high"
+
+    return {
+        "dpi": dpi,
+        "image_bytes": image_bytes,
+        "image_mime": image_mime,
+        "thumb_base64": thumb_base64,
+        "thumb_mime": thumb_mime,
+        "thumb_detail": thumb_detail,
+        "page_stats": page_stats,
+    }
@@ -0,0 +1,205 @@
+# backend/results.py
+import asyncio, os, secrets, time
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+
+from backend.state import STATE_BACKEND, SQLiteState, shared_state
+
+
+
+
+RESULT_CHUNK = 64 * 1024  # bytes per write when streaming a download
+
+
+
+
+
+
+class ResultStore:
+    """Finished artifacts (DOCX, …) waiting to be downloaded, one per job_id.
+
+    The SSE `result` event only carries a download URL with a random token.
+    GET /jobs/{job_id}/result streams the raw bytes. An entry is freed once it
+    has been served whole (not through a Range request), or RESULT_TTL seconds
+    after it was stored.
+    Only used from the event loop, so no locking.
+    """
+
+    def __init__(self):
+        self.ttl = int(os.getenv("RESULT_TTL", "600"))
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+        self.downloaded = 0
+        self.expired = 0
+
+    async def put(self, job_id: str, content: bytes, filename: str, mime: str) -> Dict[str, Any]:
+        """Store an artifact; returns the small descriptor sent in the `result` event."""
+        token = secrets.token_urlsafe(24)
+        self.results[job_id] = {
+            "token": token,
+            "content": content,
+            "filename": filename,
+            "mime": mime,
+            "expires_at": time.time() + self.ttl,
+        }
+        return {
+            "filename": filename,
+            "mime": mime,
+            "size": len(content),
+            "url": f"/jobs/{job_id}/result?token={token}",
+            "token": token,
+        }
+
+    async def get(self, job_id: str, token: str) -> Optional[Dict[str, Any]]:
+        entry = self.results.get(job_id)
+        if entry is None or not secrets.compare_digest(entry["token"], token or ""):
+            return None
+        if entry["expires_at"] < time.time():
+            await self.discard(job_id)
+            self.expired += 1
+            return None
+        return entry
+
+    async def discard(self, job_id: str):
+        self.results.pop(job_id, None)
+
+    async def mark_downloaded(self, job_id: str):
+        """Free an artifact once it was sent whole."""
+        if self.results.pop(job_id, None) is not None:
+            self.downloaded += 1
+
+    async def evict_expired(self) -> List[str]:
+        now = time.time()
+        expired = [job_id for job_id, entry in self.results.items() if entry["expires_at"] < now]
+        for job_id in expired:
+            await self.discard(job_id)
+            self.expired += 1
+        return expired
+
+    async def stats(self) -> Dict[str, int]:
+        return {
+            "results": len(self.results),
+            "bytes": sum(len(entry["content"]) for entry in self.results.values()),
+            "downloaded": self.downloaded,
+            "expired": self.expired,
+        }
+
+
+
+
+
+
+class SQLiteResultStore(ResultStore):
+    """ResultStore on the shared SQLite state (STATE_BACKEND=sqlite), so the
+    download may hit another worker than the one that ran the job. Queries
+    run in a thread (asyncio.to_thread), off the event loop."""
+
+    def __init__(self, state: SQLiteState):
+        super().__init__()
+        self.state = state
+
+    async def put(self, job_id: str, content: bytes, filename: str, mime: str) -> Dict[str, Any]:
+        token = secrets.token_urlsafe(24)
+        await asyncio.to_thread(
+            self.state.execute,
+            "INSERT OR REPLACE INTO results (job_id, token, content, filename, mime, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, token, content, filename, mime, time.time() + self.ttl),
+        )
+        return {
+            "filename": filename,
+            "mime": mime,
+            "size": len(content),
+            "url": f"/jobs/{job_id}/result?token={token}",
+            "token": token,
+        }
+
+    async def get(self, job_id: str, token: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get, job_id, token)
+
+    def _get(self, job_id: str, token: str) -> Optional[Dict[str, Any]]:
+        row = self.state.query_one(
+            "SELECT token, content, filename, mime, expires_at FROM results WHERE job_id = ?", (job_id,)
+        )
+        if row is None or not secrets.compare_digest(row[0], token or ""):
+            return None
+        if row[4] < time.time():
+            self._discard(job_id)
+            self.expired += 1
+            return None
+        return {"token": row[0], "content": bytes(row[1]), "filename": row[2], "mime": row[3], "expires_at": row[4]}
+
+    async def discard(self, job_id: str):
+        await asyncio.to_thread(self._discard, job_id)
+
+    def _discard(self, job_id: str) -> int:
+        return self.state.execute("DELETE FROM results WHERE job_id = ?", (job_id,))
+
+    async def mark_downloaded(self, job_id: str):
+        if await asyncio.to_thread(self._discard, job_id):
+            self.downloaded += 1
+
+    async def evict_expired(self) -> List[str]:
+        return await asyncio.to_thread(self._evict_expired)
+
+    def _evict_expired(self) -> List[str]:
+        expired = [row[0] for row in self.state.query(
+            "SELECT job_id FROM results WHERE expires_at < ?", (time.time(),)
+        )]
+        for job_id in expired:
+            self._discard(job_id)
+            self.expired += 1
+        return expired
+
+    async def stats(self) -> Dict[str, int]:
+        results, size = await asyncio.to_thread(
+            self.state.query_one, "SELECT COUNT(*), COALESCE(SUM(LENGTH(content)), 0) FROM results"
+        )
+        return {
+            "results": results,
+            "bytes": size,
+            "downloaded": self.downloaded,  # by this worker
+            "expired": self.expired,        # by this worker
+        }
+
+
+
+
+
+
+result_store = SQLiteResultStore(shared_state()) if STATE_BACKEND == "sqlite" else ResultStore()
+
+
+
+
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """
+    (start, end) inclusive for a single `bytes=` range, None for the whole file.
+    Raises ValueError when the range can't be satisfied.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None  # unknown unit / multipart ranges: answer with the whole file
+
+    first, _, last = spec.strip().partition("-")
+    if not first:  # suffix range: last N bytes
+        if not last.isdigit() or int(last) == 0:
+            raise ValueError(header)
+        return max(size - int(last), 0), size - 1
+    if not first.isdigit() or (last and not last.isdigit()):
+        raise ValueError(header)
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end
+
+
+def content_disposition(filename: str) -> str:
+    """attachment header with an ASCII fallback and the RFC 5987 UTF-8 name."""
+    fallback = filename.encode("ascii", "replace").decode("ascii").replace('"', "'").replace("?", "_")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
@@ -0,0 +1,140 @@
+# backend/state.py
+import os, sqlite3, threading
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional
+
+
+
+
+# Where job state lives:
+#   memory  → process-local dicts (default; one uvicorn worker only)
+#   sqlite  → one SQLite file in WAL mode shared by every worker of the host,
+#             so uploads, commits, SSE streams and downloads may each land on
+#             a different worker
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+# Holds uploaded PDFs and result DOCX in clear: keep it out of shared temp dirs.
+# The directory is created 0700 and the file (with its -wal / -shm) 0600.
+STATE_DB_PATH = os.getenv("STATE_DB_PATH") or os.path.join(
+    os.getenv("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"), "ia-avocats", "state.db"
+)
+STATE_POLL_INTERVAL = float(os.getenv("STATE_POLL_INTERVAL", "0.1"))  # SSE wait between log polls (s)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id      TEXT PRIMARY KEY,
+    created_at  REAL NOT NULL,
+    done        INTEGER NOT NULL DEFAULT 0,
+    finished_at REAL,
+    log_bytes   INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS events (
+    job_id  TEXT NOT NULL,
+    seq     INTEGER NOT NULL,
+    event   TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE TABLE IF NOT EXISTS upload_jobs (
+    job_id        TEXT PRIMARY KEY,
+    bytes         INTEGER NOT NULL DEFAULT 0,
+    last_activity REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS upload_files (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id   TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    content  BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS upload_files_job ON upload_files (job_id);
+CREATE TABLE IF NOT EXISTS committed_uploads (
+    job_id       TEXT PRIMARY KEY,
+    bytes        INTEGER NOT NULL,
+    committed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    job_id     TEXT PRIMARY KEY,
+    token      TEXT NOT NULL,
+    content    BLOB NOT NULL,
+    filename   TEXT NOT NULL,
+    mime       TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+
+
+
+
+class SQLiteState:
+    """One SQLite connection per process on the shared state file.
+
+    WAL lets readers (SSE polls) run while another worker writes; writes that
+    read-then-update (quotas, event seq numbers) use BEGIN IMMEDIATE so they
+    are serialised across processes. secure_delete zeroes the pages of
+    deleted uploads / results instead of leaving them readable in the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._create_private(path)
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA busy_timeout=10000")
+            self._conn.execute("PRAGMA secure_delete=ON")
+            self._conn.executescript(SCHEMA)
+
+    @staticmethod
+    def _create_private(path: str):
+        """Owner-only directory and files; SQLite gives -wal / -shm the mode of the main file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        for existing in (path, f"{path}-wal", f"{path}-shm"):
+            if os.path.exists(existing):
+                os.chmod(existing, 0o600)
+
+    def query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def query_one(self, sql: str, params: tuple = ()) -> Optional[tuple]:
+        rows = self.query(sql, params)
+        return rows[0] if rows else None
+
+    def execute(self, sql: str, params: tuple = ()) -> int:
+        """Run one statement in autocommit mode; returns the number of rows changed."""
+        with self._lock:
+            return self._conn.execute(sql, params).rowcount
+
+    @contextmanager
+    def transaction(self) -> Iterator[Any]:
+        """Exclusive write transaction; yields the cursor to run statements on."""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
+
+
+
+
+
+_shared_state: Optional[SQLiteState] = None
+_shared_state_lock = threading.Lock()
+
+
+def shared_state() -> SQLiteState:
+    global _shared_state
+    with _shared_state_lock:
+        if _shared_state is None:
+            _shared_state = SQLiteState(STATE_DB_PATH)
+        return _shared_state
@@ -0,0 +1,67 @@
+# backend/text_layer.py
+import os, unicodedata
+from typing import Optional
+
+import fitz
+
+
+
+
+
+
+# Read the embedded text of born-digital PDFs instead of rasterizing + OCR'ing them
+NATIVE_TEXT_LAYER = os.getenv("NATIVE_TEXT_LAYER", "1") != "0"
+
+# A text layer is only trusted when it passes all three checks below
+NATIVE_MIN_CHARS = int(os.getenv("NATIVE_MIN_CHARS", "200"))                   # non-blank characters
+NATIVE_MIN_GLYPH_RATIO = float(os.getenv("NATIVE_MIN_GLYPH_RATIO", "0.95"))    # share of sane glyphs
+NATIVE_MAX_IMAGE_COVERAGE = float(os.getenv("NATIVE_MAX_IMAGE_COVERAGE", "0.5"))  # share of page under images
+
+
+
+
+
+
+def glyph_ratio(text: str) -> float:
+    """Share of non-blank characters that are real glyphs.
+
+    Broken font encodings show up as U+FFFD, private-use or control characters.
+    """
+    chars = [c for c in text if not c.isspace()]
+    if not chars:
+        return 0.0
+    sane = sum(
+        1 for c in chars
+        if c != "\ufffd" and unicodedata.category(c) not in ("Co", "Cc", "Cs", "Cn")
+    )
+    return sane / len(chars)
+
+
+def image_coverage(page: fitz.Page) -> float:
+    """Share of the page area covered by raster images (capped at 1)."""
+    page_rect = page.rect
+    page_area = abs(page_rect) or 1.0
+    covered = 0.0
+    for info in page.get_image_info():
+        covered += abs(fitz.Rect(info["bbox"]) & page_rect)
+    return min(covered / page_area, 1.0)
+
+
+def extract_text_layer(page: fitz.Page) -> Optional[str]:
+    """Return the page's embedded text if it is good enough to skip OCR, else None.
+
+    Scanned pages (a full-page image, with or without a scanner OCR layer),
+    mostly-image pages and garbled encodings all fall back to Vision OCR.
+    Must be called under the caller's fitz lock.
+    """
+    if not NATIVE_TEXT_LAYER:
+        return None
+
+    text = page.get_text(sort=True)
+    if sum(1 for c in text if not c.isspace()) < NATIVE_MIN_CHARS:
+        return None
+    if glyph_ratio(text) < NATIVE_MIN_GLYPH_RATIO:
+        return None
+    if image_coverage(page) > NATIVE_MAX_IMAGE_COVERAGE:
+        return None
+    return text
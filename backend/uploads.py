@@ -0,0 +1,338 @@
+# backend/uploads.py
+import asyncio, os, time
+from typing import Any, Dict, List, Optional
+
+from backend.state import STATE_BACKEND, SQLiteState, shared_state
+
+try:
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+
+
+
+
+class UploadRejected(Exception):
+    """Raised when an upload can't be buffered; carries the HTTP status to answer with."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[int] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+
+
+
+
+class UploadStore:
+    """In-memory upload buffers, one bucket of files per job_id.
+
+    - process-wide byte quota (UPLOAD_QUOTA_BYTES)      → 429 + Retry-After when full
+    - per-job byte limit (UPLOAD_JOB_MAX_BYTES)          → 413
+    - buckets idle for UPLOAD_IDLE_TTL seconds without a /commit are dropped
+
+    Committed files stay counted against the quota while their job waits in
+    the scheduler and runs: `pop()` hands them over, `finish()` (called when
+    the job ends) frees their bytes. So the quota bounds every upload held in
+    memory, not only the uncommitted ones.
+    Only used from the event loop, so no locking. Every method is a coroutine
+    so that SQLiteUploadStore can run its queries off the loop.
+    """
+
+    def __init__(self):
+        self.quota_bytes = int(os.getenv("UPLOAD_QUOTA_BYTES", str(1024 * 1024 * 1024)))
+        self.job_max_bytes = int(os.getenv("UPLOAD_JOB_MAX_BYTES", str(300 * 1024 * 1024)))
+        self.idle_ttl = int(os.getenv("UPLOAD_IDLE_TTL", "900"))
+        self.retry_after = int(os.getenv("UPLOAD_RETRY_AFTER", "30"))
+
+        self.buckets: Dict[str, List[Dict[str, Any]]] = {}
+        self.job_bytes: Dict[str, int] = {}
+        self.last_activity: Dict[str, float] = {}
+        self.committed: Dict[str, int] = {}   # job_id -> bytes handed over to a queued / running job
+        self.used_bytes = 0
+
+        self.evicted_jobs = 0
+        self.rejected_uploads = 0
+
+    async def create(self, job_id: str):
+        self.buckets[job_id] = []
+        self.job_bytes[job_id] = 0
+        self.last_activity[job_id] = time.time()
+
+    async def exists(self, job_id: str) -> bool:
+        return job_id in self.buckets
+
+    async def reserve(self, job_id: str, nbytes: int):
+        """Count nbytes against the job and the global quota, or raise UploadRejected."""
+        if self.job_bytes[job_id] + nbytes > self.job_max_bytes:
+            self.rejected_uploads += 1
+            raise UploadRejected(413, f"Upload exceeds the per-job limit of {self.job_max_bytes} bytes")
+        if self.used_bytes + nbytes > self.quota_bytes:
+            self.rejected_uploads += 1
+            raise UploadRejected(429, "Server upload buffer is full, retry later",
+                                 retry_after=self.retry_after)
+        self.job_bytes[job_id] += nbytes
+        self.used_bytes += nbytes
+        self.last_activity[job_id] = time.time()
+
+    async def release(self, job_id: str, nbytes: int):
+        """Give back bytes reserved for a file that was finally not stored."""
+        if job_id in self.job_bytes:
+            self.job_bytes[job_id] -= nbytes
+        self.used_bytes -= nbytes
+
+    async def add_file(self, job_id: str, filename: str, content: bytes):
+        """Store a file whose bytes were already reserved."""
+        self.buckets[job_id].append({"filename": filename, "content": content})
+        self.last_activity[job_id] = time.time()
+
+    async def pop(self, job_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Hand the files over to a job (on /commit); their bytes stay reserved until finish()."""
+        return self._take(job_id)
+
+    def _take(self, job_id: str) -> Optional[List[Dict[str, Any]]]:
+        files = self.buckets.pop(job_id, None)
+        if files is not None:
+            self.committed[job_id] = self.job_bytes.pop(job_id, 0)
+            self.last_activity.pop(job_id, None)
+        return files
+
+    async def finish(self, job_id: str):
+        """The job that took the files is over (or never started): free their quota."""
+        self.used_bytes -= self.committed.pop(job_id, 0)
+
+    async def evict_idle(self) -> List[str]:
+        """Drop buckets with no upload activity for idle_ttl seconds."""
+        cutoff = time.time() - self.idle_ttl
+        expired = [job_id for job_id, ts in self.last_activity.items() if ts < cutoff]
+        for job_id in expired:
+            self._take(job_id)
+            await self.finish(job_id)
+            self.evicted_jobs += 1
+        return expired
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "jobs": len(self.buckets),
+            "files": sum(len(files) for files in self.buckets.values()),
+            "used_bytes": self.used_bytes,
+            "committed_bytes": sum(self.committed.values()),
+            "quota_bytes": self.quota_bytes,
+            "job_max_bytes": self.job_max_bytes,
+            "idle_ttl": self.idle_ttl,
+            "evicted_jobs": self.evicted_jobs,
+            "rejected_uploads": self.rejected_uploads,
+        }
+
+
+
+
+
+
+class SQLiteUploadStore(UploadStore):
+    """UploadStore on the shared SQLite state (STATE_BACKEND=sqlite).
+
+    Files are stored as BLOBs when received, so a batch uploaded to one worker
+    can be committed on another. Quotas are checked in one write transaction,
+    hence hold across all workers. Committed bytes are tracked in
+    committed_uploads until finish(); rows older than UPLOAD_COMMITTED_TTL are
+    dropped in case the worker running the job died. Every query runs in a
+    thread (asyncio.to_thread), not on the event loop.
+    """
+
+    def __init__(self, state: SQLiteState):
+        super().__init__()
+        self.state = state
+        self.committed_ttl = int(os.getenv("UPLOAD_COMMITTED_TTL", str(6 * 3600)))
+
+    async def create(self, job_id: str):
+        await asyncio.to_thread(self.state.execute,
+                                "INSERT OR IGNORE INTO upload_jobs (job_id, last_activity) VALUES (?, ?)",
+                                (job_id, time.time()))
+
+    async def exists(self, job_id: str) -> bool:
+        row = await asyncio.to_thread(self.state.query_one, "SELECT 1 FROM upload_jobs WHERE job_id = ?", (job_id,))
+        return row is not None
+
+    async def reserve(self, job_id: str, nbytes: int):
+        await asyncio.to_thread(self._reserve, job_id, nbytes)
+
+    def _reserve(self, job_id: str, nbytes: int):
+        with self.state.transaction() as cursor:
+            row = cursor.execute("SELECT bytes FROM upload_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            used = cursor.execute(
+                "SELECT (SELECT COALESCE(SUM(bytes), 0) FROM upload_jobs)"
+                " + (SELECT COALESCE(SUM(bytes), 0) FROM committed_uploads)"
+            ).fetchone()[0]
+            if row is None or row[0] + nbytes > self.job_max_bytes:
+                self.rejected_uploads += 1
+                raise UploadRejected(413, f"Upload exceeds the per-job limit of {self.job_max_bytes} bytes")
+            if used + nbytes > self.quota_bytes:
+                self.rejected_uploads += 1
+                raise UploadRejected(429, "Server upload buffer is full, retry later",
+                                     retry_after=self.retry_after)
+            cursor.execute("UPDATE upload_jobs SET bytes = bytes + ?, last_activity = ? WHERE job_id = ?",
+                           (nbytes, time.time(), job_id))
+
+    async def release(self, job_id: str, nbytes: int):
+        await asyncio.to_thread(self.state.execute, "UPDATE upload_jobs SET bytes = bytes - ? WHERE job_id = ?", (nbytes, job_id))
+
+    async def add_file(self, job_id: str, filename: str, content: bytes):
+        await asyncio.to_thread(self._add_file, job_id, filename, content)
+
+    def _add_file(self, job_id: str, filename: str, content: bytes):
+        with self.state.transaction() as cursor:
+            cursor.execute("INSERT INTO upload_files (job_id, filename, content) VALUES (?, ?, ?)",
+                           (job_id, filename, content))
+            cursor.execute("UPDATE upload_jobs SET last_activity = ? WHERE job_id = ?", (time.time(), job_id))
+
+    async def pop(self, job_id: str) -> Optional[List[Dict[str, Any]]]:
+        return await asyncio.to_thread(self._take, job_id)
+
+    def _take(self, job_id: str) -> Optional[List[Dict[str, Any]]]:
+        with self.state.transaction() as cursor:
+            row = cursor.execute("SELECT bytes FROM upload_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            cursor.execute("DELETE FROM upload_jobs WHERE job_id = ?", (job_id,))
+            cursor.execute("INSERT OR REPLACE INTO committed_uploads (job_id, bytes, committed_at) VALUES (?, ?, ?)",
+                           (job_id, row[0], time.time()))
+            rows = cursor.execute("SELECT filename, content FROM upload_files WHERE job_id = ? ORDER BY id",
+                                  (job_id,)).fetchall()
+            cursor.execute("DELETE FROM upload_files WHERE job_id = ?", (job_id,))
+        return [{"filename": filename, "content": bytes(content)} for filename, content in rows]
+
+    async def finish(self, job_id: str):
+        await asyncio.to_thread(self._finish, job_id)
+
+    def _finish(self, job_id: str):
+        self.state.execute("DELETE FROM committed_uploads WHERE job_id = ?", (job_id,))
+
+    async def evict_idle(self) -> List[str]:
+        return await asyncio.to_thread(self._evict_idle)
+
+    def _evict_idle(self) -> List[str]:
+        cutoff = time.time() - self.idle_ttl
+        expired = [row[0] for row in self.state.query(
+            "SELECT job_id FROM upload_jobs WHERE last_activity < ?", (cutoff,)
+        )]
+        for job_id in expired:
+            if self._take(job_id) is not None:
+                self.evicted_jobs += 1
+            self._finish(job_id)
+        self.state.execute("DELETE FROM committed_uploads WHERE committed_at < ?",
+                           (time.time() - self.committed_ttl,))
+        return expired
+
+    async def stats(self) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._stats)
+
+    def _stats(self) -> Dict[str, Any]:
+        jobs, used = self.state.query_one("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM upload_jobs")
+        committed = self.state.query_one("SELECT COALESCE(SUM(bytes), 0) FROM committed_uploads")[0]
+        return {
+            "jobs": jobs,
+            "files": self.state.query_one("SELECT COUNT(*) FROM upload_files")[0],
+            "used_bytes": used + committed,
+            "committed_bytes": committed,
+            "quota_bytes": self.quota_bytes,
+            "job_max_bytes": self.job_max_bytes,
+            "idle_ttl": self.idle_ttl,
+            "evicted_jobs": self.evicted_jobs,          # by this worker
+            "rejected_uploads": self.rejected_uploads,  # by this worker
+        }
+
+
+
+
+
+
+class MultipartFiles:
+    """Streaming multipart/form-data parser that keeps the file parts in memory.
+
+    Starlette's own form parsing reads the whole body before the endpoint runs
+    and spools parts over 1 MiB to temporary files; this one is fed the request
+    stream chunk by chunk, so the caller can reserve quota as bytes arrive and
+    nothing is written to disk. Only parts of `field_name` with a filename are
+    kept, other fields are ignored.
+    """
+
+    def __init__(self, boundary: bytes, field_name: str = "files"):
+        self.field_name = field_name.encode()
+        self.files: List[Dict[str, Any]] = []
+        self.pending = 0  # file bytes received since the caller last took them with take_pending()
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._current: Optional[bytearray] = None
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        })
+
+    @classmethod
+    def for_content_type(cls, content_type: str) -> Optional["MultipartFiles"]:
+        """A parser for this Content-Type header, or None if it isn't multipart/form-data."""
+        mime, options = parse_options_header(content_type)
+        if mime != b"multipart/form-data" or not options.get(b"boundary"):
+            return None
+        return cls(options[b"boundary"])
+
+    def write(self, chunk: bytes):
+        self._parser.write(chunk)
+
+    def finalize(self):
+        self._parser.finalize()
+
+    def take_pending(self) -> int:
+        pending, self.pending = self.pending, 0
+        return pending
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        filename = options.get(b"filename")
+        if options.get(b"name") == self.field_name and filename is not None:
+            self._current = bytearray()
+            self.files.append({"filename": filename.decode("utf-8", "replace") or "upload.pdf",
+                               "content": self._current})
+        else:
+            self._current = None
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._current is not None:
+            self._current += data[start:end]
+            self.pending += end - start
+
+    def _on_part_end(self):
+        self._current = None
+
+
+
+
+
+
+upload_store = SQLiteUploadStore(shared_state()) if STATE_BACKEND == "sqlite" else UploadStore()
@@ -0,0 +1,106 @@
+# bench/corpus.py
+import random
+from typing import Dict, List, Tuple
+
+import fitz
+
+from bench.fakes import LOREM
+
+
+
+
+# Share of each page type per dossier kind
+DOSSIER_KINDS: Dict[str, Dict[str, float]] = {
+    "digital":     {"digital": 1.0},
+    "scanned":     {"scanned": 1.0},
+    "blank_heavy": {"blank": 0.5, "scanned": 0.25, "digital": 0.25},
+    "image_heavy": {"image": 0.6, "scanned": 0.4},
+}
+
+PAGE_RECT = fitz.paper_rect("a4")
+SCAN_DPI = 110
+
+
+
+
+
+
+def _paragraphs(rng: random.Random, count: int) -> str:
+    return "\n\n".join(f"Article {rng.randint(1, 99)}. " + LOREM * rng.randint(1, 2) for _ in range(count))
+
+
+def add_digital_page(document: fitz.Document, rng: random.Random):
+    """Born-digital page: a real text layer."""
+    page = document.new_page(width=PAGE_RECT.width, height=PAGE_RECT.height)
+    page.insert_textbox(PAGE_RECT + (50, 60, -50, -60), _paragraphs(rng, 5), fontsize=9)
+
+
+def add_scanned_page(document: fitz.Document, rng: random.Random):
+    """Scan: the text only exists as a grayscale JPEG, no text layer."""
+    source = fitz.open()
+    page = source.new_page(width=PAGE_RECT.width, height=PAGE_RECT.height)
+    page.insert_textbox(PAGE_RECT + (50, 60, -50, -60), _paragraphs(rng, 5), fontsize=9)
+    pix = page.get_pixmap(dpi=SCAN_DPI, colorspace=fitz.csGRAY)
+    image = pix.tobytes("jpeg", jpg_quality=70)
+    source.close()
+
+    scanned = document.new_page(width=PAGE_RECT.width, height=PAGE_RECT.height)
+    scanned.insert_image(scanned.rect, stream=image)
+
+
+def add_blank_page(document: fitz.Document, rng: random.Random):
+    """Separator / verso left blank."""
+    document.new_page(width=PAGE_RECT.width, height=PAGE_RECT.height)
+
+
+def add_image_page(document: fitz.Document, rng: random.Random):
+    """Photo-like page: large coloured shapes and a short caption."""
+    page = document.new_page(width=PAGE_RECT.width, height=PAGE_RECT.height)
+    for _ in range(rng.randint(8, 16)):
+        x, y = rng.uniform(40, 450), rng.uniform(40, 700)
+        color = (rng.random(), rng.random(), rng.random())
+        if rng.random() < 0.5:
+            page.draw_rect(fitz.Rect(x, y, x + rng.uniform(60, 200), y + rng.uniform(60, 200)),
+                           color=color, fill=color)
+        else:
+            page.draw_circle((x, y), rng.uniform(20, 90), color=color, fill=color)
+    page.insert_text((50, 800), "Photo n°" + str(rng.randint(1, 40)), fontsize=8)
+
+
+PAGE_BUILDERS = {
+    "digital": add_digital_page,
+    "scanned": add_scanned_page,
+    "blank": add_blank_page,
+    "image": add_image_page,
+}
+
+
+
+
+
+
+def make_pdf(kind: str, pages: int, seed: int) -> bytes:
+    """One PDF of `pages` pages drawn from the page mix of a dossier kind."""
+    rng = random.Random(seed)
+    mix = DOSSIER_KINDS[kind]
+    document = fitz.open()
+    for _ in range(pages):
+        page_type = rng.choices(list(mix), weights=list(mix.values()))[0]
+        PAGE_BUILDERS[page_type](document, rng)
+    data = document.tobytes(garbage=3, deflate=True)
+    document.close()
+    return data
+
+
+def make_dossier(kind: str, pieces: int, pages: Tuple[int, int], seed: int) -> List[Tuple[str, bytes]]:
+    """(filename, pdf bytes) for each pièce of a dossier; filenames carry the pièce number."""
+    rng = random.Random(seed)
+    return [
+        (f"Pièce {number}.pdf", make_pdf(kind, rng.randint(*pages), rng.randint(0, 2 ** 31)))
+        for number in range(1, pieces + 1)
+    ]
+
+
+def page_count(pdf: bytes) -> int:
+    with fitz.open(stream=pdf, filetype="pdf") as document:
+        return len(document)
@@ -0,0 +1,274 @@
+# bench/fakes.py
+import hashlib, io, json, random, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict
+
+from docx import Document
+from PIL import Image, ImageStat
+
+
+
+
+# Local stand-ins for the paid providers, with configurable latency + jitter:
+#   FakeVisionClient   → google.cloud.vision.ImageAnnotatorClient
+#   FakeOpenAIServer   → OpenAI chat completions (the gateway points at it via base_url)
+#   FakeAdobeServer    → Adobe PDF Services REST API (the exporter points at it via ADOBE_BASE_URL)
+
+LOREM = (
+    "Le requérant expose que la société défenderesse a manqué à ses obligations contractuelles. "
+    "Par courrier recommandé, il a mis en demeure son cocontractant de régulariser la situation. "
+    "Aucune réponse n'a été apportée dans le délai imparti, de sorte qu'une procédure a été engagée. "
+    "Les pièces versées aux débats établissent la réalité du préjudice subi et son étendue. "
+)
+
+MONTHS = ["janvier", "février", "mars", "avril", "mai", "juin", "juillet",
+          "août", "septembre", "octobre", "novembre", "décembre"]
+
+
+
+
+
+
+def sleep_with_jitter(latency: float, jitter: float, rng: random.Random):
+    time.sleep(max(0.0, latency + rng.uniform(-jitter, jitter)))
+
+
+def seeded_rng(data: bytes) -> random.Random:
+    return random.Random(hashlib.sha256(data).digest())
+
+
+
+
+
+
+class FakeVisionClient:
+    """document_text_detection() that "reads" the rendered page from its pixels.
+
+    Colourful pages (photos, plans) give a short caption, near-white pages give
+    nothing, grey text scans give 1–2k characters, like real OCR would.
+    """
+
+    def __init__(self, latency: float = 0.15, jitter: float = 0.05):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def document_text_detection(self, image) -> SimpleNamespace:
+        content = image["content"]
+        with self._lock:
+            self.calls += 1
+        rng = seeded_rng(content)
+        sleep_with_jitter(self.latency, self.jitter, rng)
+
+        page = Image.open(io.BytesIO(content))
+        # ~1000 px keeps 9 pt text strokes dark; a 256 px thumbnail greys them
+        # out and a scan would "read" as blank
+        page.thumbnail((1024, 1024))
+        saturation = ImageStat.Stat(page.convert("HSV")).mean[1] if page.mode != "L" else 0
+        histogram = page.convert("L").histogram()
+        ink = sum(histogram[:128]) / max(sum(histogram), 1)
+
+        if saturation > 40:
+            text = "Photographie du chantier, vue d'ensemble."
+        elif ink < 0.002:
+            text = ""
+        else:
+            text = (LOREM * 6)[: rng.randint(1200, 2000)]
+        return SimpleNamespace(full_text_annotation=SimpleNamespace(text=text) if text else None)
+
+
+
+
+
+
+def fake_completion(text: str, rng: random.Random) -> str:
+    """Plausible answer for each prompt template of app_logic."""
+    if '"label": "TEXT" | "IMAGE" | "SKIP"' in text:
+        return json.dumps({"label": "IMAGE", "description": "La pièce image montre un chantier en cours."},
+                          ensure_ascii=False)
+    if 'output ONLY with either "TEXT", "IMAGE", or "SKIP"' in text:
+        return "IMAGE"
+    if "La pièce image montre" in text:
+        return "La pièce image montre un chantier en cours."
+    if "ligne de bordereau" in text:
+        return rng.choice(["Contrat de prestation", "Mise en demeure", "Attestation de Monsieur DUPONT"])
+    if "Génère un titre" in text:
+        return "Photographies du chantier."
+    if "Le <date>" in text:
+        return (f"Le {rng.randint(1, 28)} {rng.choice(MONTHS)} {rng.randint(2015, 2024)}, "
+                f"le requérant a mis en demeure la société défenderesse.\n\n{LOREM[:300]}")
+    return LOREM[: rng.randint(200, 400)]
+
+
+class FakeOpenAIServer:
+    """Minimal /v1/chat/completions server on 127.0.0.1 (random port)."""
+
+    def __init__(self, latency: float = 0.4, jitter: float = 0.2):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self) -> str:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                request = json.loads(body)
+                content = request["messages"][0]["content"]
+                text = content if isinstance(content, str) else content[0]["text"]
+
+                with fake._lock:
+                    fake.calls += 1
+                rng = seeded_rng(body)
+                sleep_with_jitter(fake.latency, fake.jitter, rng)
+
+                answer = json.dumps({
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": fake_completion(text, rng)}}],
+                    "usage": {"prompt_tokens": len(text) // 4, "completion_tokens": 50,
+                              "total_tokens": len(text) // 4 + 50},
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(answer)))
+                self.end_headers()
+                self.wfile.write(answer)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+
+
+
+
+class FakeAdobeServer:
+    """PDF Services REST look-alike on 127.0.0.1 (random port).
+
+    /token, /assets (+ PUT upload), /operation/exportpdf, status polling and
+    download; an export is "in progress" for `latency` seconds, then returns a
+    small DOCX. `throttle_rate` answers that share of API calls with 429 +
+    Retry-After, to exercise the backoff.
+    """
+
+    def __init__(self, latency: float = 2.0, jitter: float = 0.5, throttle_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.calls = 0        # export jobs submitted
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+        self._jobs: Dict[str, float] = {}  # job id -> ready at (monotonic)
+        self._server = None
+
+    def _docx(self) -> bytes:
+        document = Document()
+        document.add_heading("Document converti", level=1)
+        for _ in range(20):
+            document.add_paragraph(LOREM)
+        buf = io.BytesIO()
+        document.save(buf)
+        return buf.getvalue()
+
+    def start(self) -> str:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes = b"", content_type: str = "application/json",
+                      headers: Dict[str, str] = None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json(self, status: int, data: dict, headers: Dict[str, str] = None):
+                self._send(status, json.dumps(data).encode(), headers=headers)
+
+            def _throttled(self) -> bool:
+                with fake._lock:
+                    throttle = fake._rng.random() < fake.throttle_rate
+                    fake.throttled += throttle
+                if throttle:
+                    self._json(429, {"error": {"code": "TOO_MANY_REQUESTS"}}, {"Retry-After": "0.2"})
+                return throttle
+
+            def _base(self) -> str:
+                return f"http://{self.headers['Host']}"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path == "/token":
+                    return self._json(200, {"access_token": uuid.uuid4().hex, "token_type": "bearer",
+                                            "expires_in": 86399})
+                if self._throttled():
+                    return
+                if self.path == "/assets":
+                    asset_id = uuid.uuid4().hex
+                    return self._json(200, {"assetID": asset_id, "uploadUri": f"{self._base()}/upload/{asset_id}"})
+                if self.path == "/operation/exportpdf":
+                    job_id = uuid.uuid4().hex
+                    delay = max(0.0, fake.latency + fake._rng.uniform(-fake.jitter, fake.jitter))
+                    with fake._lock:
+                        fake.calls += 1
+                        fake._jobs[job_id] = time.monotonic() + delay
+                    return self._send(201, headers={
+                        "location": f"{self._base()}/operation/exportpdf/{job_id}/status"})
+                self._json(404, {"error": {"code": "NOT_FOUND"}})
+
+            def do_PUT(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self._send(200)
+
+            def do_GET(self):
+                parts = self.path.strip("/").split("/")
+                if parts[0] == "download":
+                    return self._send(200, fake._docx(), "application/vnd.openxmlformats-officedocument"
+                                                         ".wordprocessingml.document")
+                if self._throttled():
+                    return
+                if len(parts) == 4 and parts[-1] == "status" and parts[2] in fake._jobs:
+                    if time.monotonic() < fake._jobs[parts[2]]:
+                        return self._json(200, {"status": "in progress"})
+                    return self._json(200, {"status": "done", "asset": {
+                        "assetID": parts[2], "downloadUri": f"{self._base()}/download/{parts[2]}"}})
+                self._json(404, {"error": {"code": "NOT_FOUND"}})
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-adobe", daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
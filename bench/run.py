@@ -0,0 +1,318 @@
+# bench/run.py
+"""
+Offline benchmark of /summaries, /pdf2word and /docresume.
+
+Runs the real FastAPI app (uvicorn, in-process) against local fakes of
+Google Vision, OpenAI and Adobe PDF Services, on a synthetic corpus, and
+writes pages/sec, per-job p50/p95, peak RSS and thread count to JSON.
+
+    python -m bench.run                                  # defaults, → bench_output.json
+    python -m bench.run --jobs 8 --concurrency 4 --llm-latency 0.8
+    python -m bench.run --compare bench_output.previous.json
+
+Every job gets its own synthetic documents, so the OCR / GPT caches only
+help within a job, like in production.
+"""
+import argparse, itertools, json, os, platform, resource, socket, statistics, subprocess, sys, threading, time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.corpus import DOSSIER_KINDS, make_dossier, make_pdf, page_count
+from bench.fakes import FakeAdobeServer, FakeOpenAIServer, FakeVisionClient
+
+
+
+
+SCENARIOS = ("summaries", "pdf2word", "docresume")
+API_KEY = "bench"
+
+
+
+
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of %(default)s")
+    parser.add_argument("--kinds", default=",".join(DOSSIER_KINDS), help="dossier kinds, used in turn per job")
+    parser.add_argument("--jobs", type=int, default=4, help="jobs per scenario")
+    parser.add_argument("--concurrency", type=int, default=2, help="jobs in flight per scenario")
+    parser.add_argument("--pieces", type=int, default=3, help="pièces per /summaries dossier")
+    parser.add_argument("--pages", default="2-6", help="pages per PDF, min-max")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--vision-latency", type=float, default=0.15)
+    parser.add_argument("--vision-jitter", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.4)
+    parser.add_argument("--llm-jitter", type=float, default=0.2)
+    parser.add_argument("--adobe-latency", type=float, default=2.0)
+    parser.add_argument("--adobe-jitter", type=float, default=0.5)
+    parser.add_argument("--adobe-throttle", type=float, default=0.0, help="share of Adobe calls answered 429")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", help="previous JSON output to diff against")
+    return parser.parse_args(argv)
+
+
+
+
+
+
+# -----------------------------
+# Process sampling
+# -----------------------------
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # peak, KB on Linux
+
+
+def current_threads() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return threading.active_count()
+
+
+class Sampler:
+    """Peak RSS / OS thread count of this process while a scenario runs."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bench-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, current_rss_bytes())
+            self.peak_threads = max(self.peak_threads, current_threads())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "Sampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+
+
+
+
+# -----------------------------
+# App under test
+# -----------------------------
+def start_app(args: argparse.Namespace) -> Tuple[Any, str, Dict[str, Any]]:
+    """Fakes in place, then the real app on a local port; returns (server, base_url, fakes)."""
+    openai_fake = FakeOpenAIServer(args.llm_latency, args.llm_jitter)
+    adobe_fake = FakeAdobeServer(args.adobe_latency, args.adobe_jitter, args.adobe_throttle)
+    os.environ.update({
+        "OPENAI_BASE_URL": openai_fake.start(),
+        "ADOBE_BASE_URL": adobe_fake.start(),
+        "OPENAI_API_KEY": API_KEY,
+        "API_KEY": API_KEY,
+        "ADOBE_CLIENT_ID": API_KEY,
+        "ADOBE_CLIENT_SECRET": API_KEY,
+        "GOOGLE_APPLICATION_CREDENTIALS": os.devnull,
+    })
+
+    import uvicorn
+    from backend.providers import vision_provider
+
+    vision_fake = FakeVisionClient(args.vision_latency, args.vision_jitter)
+    vision_provider.override(lambda: vision_fake)
+
+    import main
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="bench-uvicorn", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}", {"vision": vision_fake, "openai": openai_fake, "adobe": adobe_fake}
+
+
+def run_job(base_url: str, scenario: str, files: List[Tuple[str, bytes]]) -> Dict[str, Any]:
+    """Upload → commit → follow the SSE stream to `done` → download the result."""
+    start = time.perf_counter()
+    error = None
+    with httpx.Client(base_url=base_url, headers={"x-api-key": API_KEY}, timeout=600) as client:
+        job_id = client.post("/jobs/new").json()["job_id"]
+        client.post("/uploads/batch", params={"job_id": job_id},
+                    files=[("files", (name, data, "application/pdf")) for name, data in files]).raise_for_status()
+        client.post(f"/{scenario}/commit", params={"job_id": job_id}).raise_for_status()
+
+        result = None
+        first_content = None
+        with client.stream("GET", f"/{scenario}/stream", params={"job_id": job_id, "api_key": API_KEY}) as stream:
+            for line in stream.iter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                if event.get("event") in ("piece_result", "result") and first_content is None:
+                    first_content = time.perf_counter() - start
+                if event.get("event") == "error":
+                    error = event.get("detail")
+                elif event.get("event") == "result":
+                    result = event.get("data")
+                elif event.get("event") == "done":
+                    break
+
+        if result and result.get("url"):
+            download = client.get(result["url"])
+            if download.status_code != 200 or len(download.content) != result["size"]:
+                error = error or f"download failed ({download.status_code})"
+        elif not result and not error:
+            error = "no result"
+
+    return {"seconds": time.perf_counter() - start, "first_content": first_content, "error": error,
+            "engine": (result or {}).get("engine")}
+
+
+def percentile(values: List[float], q: float) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+
+def run_scenario(base_url: str, scenario: str, args: argparse.Namespace) -> Dict[str, Any]:
+    kinds = itertools.cycle(args.kinds.split(","))
+    low, high = (int(n) for n in args.pages.split("-"))
+
+    jobs = []
+    for index in range(args.jobs):
+        seed = args.seed * 100003 + index * 7919 + SCENARIOS.index(scenario)
+        kind = next(kinds)
+        if scenario == "summaries":
+            files = make_dossier(kind, args.pieces, (low, high), seed)
+        else:
+            files = [("document.pdf", make_pdf(kind, high, seed))]
+        jobs.append((kind, files))
+    pages = sum(page_count(data) for _, files in jobs for _, data in files)
+
+    with Sampler() as sampler, ThreadPoolExecutor(max_workers=args.concurrency,
+                                                  thread_name_prefix="bench-client") as pool:
+        start = time.perf_counter()
+        outcomes = list(pool.map(lambda job: run_job(base_url, scenario, job[1]), jobs))
+        wall = time.perf_counter() - start
+
+    latencies = [outcome["seconds"] for outcome in outcomes]
+    first_contents = [outcome["first_content"] for outcome in outcomes if outcome["first_content"] is not None]
+    errors = [outcome["error"] for outcome in outcomes if outcome["error"]]
+    return {
+        "jobs": len(jobs),
+        "kinds": sorted({kind for kind, _ in jobs}),
+        "pages": pages,
+        "engines": dict(Counter(outcome["engine"] for outcome in outcomes if outcome["engine"])),
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "wall_seconds": round(wall, 3),
+        "pages_per_second": round(pages / wall, 3) if wall else 0.0,
+        "job_p50_seconds": round(percentile(latencies, 50), 3),
+        "job_p95_seconds": round(percentile(latencies, 95), 3),
+        # Time until the first summary / result reaches the client (piece_result on /summaries)
+        "first_content_p50_seconds": round(percentile(first_contents, 50), 3),
+        "peak_rss_mb": round(sampler.peak_rss / 2 ** 20, 1),
+        "peak_threads": sampler.peak_threads,
+        "client_threads": args.concurrency,
+    }
+
+
+def stage_summary() -> Dict[str, Dict[str, float]]:
+    """count / mean seconds per stage, from the app's own metrics."""
+    from backend.metrics import stage_seconds
+
+    stages: Dict[str, Dict[str, float]] = {}
+    for name, labels, value in stage_seconds.samples():
+        stage = dict(labels)["stage"]
+        if name.endswith("_count"):
+            stages.setdefault(stage, {})["count"] = value
+        elif name.endswith("_sum"):
+            stages.setdefault(stage, {})["seconds"] = value
+    return {
+        stage: {"count": int(v.get("count", 0)),
+                "mean_seconds": round(v.get("seconds", 0) / v["count"], 4) if v.get("count") else 0.0}
+        for stage, v in sorted(stages.items())
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any]) -> List[str]:
+    lines = []
+    for scenario, now in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(scenario)
+        if not before:
+            continue
+        for key in ("pages_per_second", "job_p50_seconds", "job_p95_seconds", "first_content_p50_seconds",
+                    "peak_rss_mb"):
+            if before.get(key):
+                change = (now[key] - before[key]) / before[key] * 100
+                lines.append(f"{scenario:10} {key:18} {before[key]:>10} → {now[key]:>10}  ({change:+.1f} %)")
+    return lines
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS) | set(args.kinds.split(",")) - set(DOSSIER_KINDS)
+    if unknown:
+        sys.exit(f"Unknown scenario / kind: {', '.join(sorted(unknown))}")
+
+    server, base_url, fakes = start_app(args)
+    try:
+        results = {}
+        for scenario in scenarios:
+            print(f"→ {scenario}: {args.jobs} job(s), {args.concurrency} at a time…", flush=True)
+            results[scenario] = run_scenario(base_url, scenario, args)
+            print(f"  {results[scenario]['pages_per_second']} pages/s, "
+                  f"p50 {results[scenario]['job_p50_seconds']} s, p95 {results[scenario]['job_p95_seconds']} s, "
+                  f"{results[scenario]['errors']} error(s)", flush=True)
+    finally:
+        server.should_exit = True
+        fakes["openai"].stop()
+        fakes["adobe"].stop()
+
+    output = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "scenarios": results,
+        "stages": stage_summary(),
+        "fake_calls": {name: fake.calls for name, fake in fakes.items()},
+        "adobe_throttled": fakes["adobe"].throttled,
+        "peak_rss_mb_process": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(output, json.load(f))))
+
+
+if __name__ == "__main__":
+    main()
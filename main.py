@@ -1,11 +1,18 @@
 # main.py
-from fastapi import FastAPI, UploadFile, File, HTTPException, status, Header, BackgroundTasks, Query
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request, status, Header, Query
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.requests import ClientDisconnect
 from typing import List, Dict, Optional
-import os, asyncio, json, time
+import os, asyncio, time
 from dotenv import load_dotenv
-from backend.jobs import job_store, start_processing, start_pdf_to_word, start_doc_resume
+from backend.jobs import job_store, job_scheduler, reap_finished_jobs, start_processing, start_pdf_to_word, start_doc_resume
+from backend.uploads import upload_store, MultipartFiles, MultipartParseError, UploadRejected
+from backend.results import result_store, parse_range, content_disposition, RESULT_CHUNK
+from backend.blank_pages import blank_page_counter
+from backend.cache import docx_cache, llm_cache, ocr_cache
+from backend.providers import providers
+from backend.metrics import registry, sse_connections, uploaded_bytes, uploaded_files, CONTENT_TYPE
 
 
 
@@ -42,13 +49,20 @@ app.add_middleware(
 # -----------------------------
 load_dotenv()
 API_KEY = os.getenv("API_KEY")
+# Optional per-tenant keys, "cabinet-a:key1,cabinet-b:key2": a request made with
+# one of them is scheduled as that tenant, whatever X-Tenant says (see tenant_of)
+TENANT_API_KEYS = {
+    key.strip(): tenant.strip()
+    for tenant, _, key in (entry.partition(":") for entry in os.getenv("TENANT_API_KEYS", "").split(","))
+    if tenant.strip() and key.strip()
+}
 
 
 
 
 
 def check_api_key(key: Optional[str]) -> None:
-    if key != API_KEY:
+    if key != API_KEY and key not in TENANT_API_KEYS:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or missing API Key"
@@ -57,7 +71,44 @@ def check_api_key(key: Optional[str]) -> None:
 
 
 
-uploads_cache: Dict[str, List[Dict[str, bytes]]] = {}
+# Uploaded files are buffered in memory by upload_store until a /commit
+UPLOAD_READ_CHUNK = 1024 * 1024
+# Slack for multipart boundaries / part headers when checking Content-Length
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+UPLOAD_REAP_INTERVAL = 60
+
+
+
+
+async def evict_idle_uploads():
+    """Free the buffers of jobs that were never committed, and forget those jobs."""
+    for job_id in await upload_store.evict_idle():
+        await job_store.discard(job_id)
+
+
+async def reap_idle_uploads():
+    while True:
+        await asyncio.sleep(UPLOAD_REAP_INTERVAL)
+        await evict_idle_uploads()
+        await result_store.evict_expired()
+
+
+@app.on_event("startup")
+async def start_reapers():
+    asyncio.create_task(reap_idle_uploads())
+    asyncio.create_task(reap_finished_jobs())
+    job_scheduler.start()
+    providers.start_warm_up()  # PROVIDER_WARMUP=1: SDK clients built before the first job
+
+
+
+
+async def pop_uploads(job_id: str) -> List[Dict[str, bytes]]:
+    """Files of a committed job; they count against the upload quota until the job ends."""
+    buffered = await upload_store.pop(job_id)
+    if buffered is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job_id")
+    return buffered
 
 
 
@@ -69,14 +120,87 @@ def health() -> Dict[str, str]:
 
 
 
+async def collect_app_stats():
+    """Metric families read from the stores and caches at scrape time."""
+    jobs, scheduler = await job_store.stats(), job_scheduler.stats()
+    uploads, results = await upload_store.stats(), await result_store.stats()
+    ocr, llm, docx, blank = ocr_cache.stats(), llm_cache.stats(), docx_cache.stats(), blank_page_counter.stats()
+    clients = providers.stats()
+    return [
+        ("ia_jobs", "gauge", "Jobs by state (queued / running in this worker, live / finished in the store).", [
+            ({"state": "queued"}, sum(scheduler["queued"].values())),
+            ({"state": "running"}, scheduler["running"]),
+            ({"state": "live"}, jobs["live_jobs"]),
+            ({"state": "finished"}, jobs["finished_jobs"]),
+        ]),
+        ("ia_queue_depth", "gauge", "Jobs waiting for a scheduler worker, by lane.",
+         [({"lane": lane}, depth) for lane, depth in scheduler["queued"].items()]),
+        ("ia_jobs_evicted_total", "counter", "Jobs dropped after their retention window.",
+         [({}, jobs["evicted_jobs"])]),
+        ("ia_job_events_dropped_total", "counter", "Progress events dropped by full job logs.",
+         [({}, jobs["dropped_events"])]),
+        ("ia_upload_buffer_bytes", "gauge", "Upload bytes held for uncommitted, queued and running jobs.",
+         [({}, uploads["used_bytes"])]),
+        ("ia_uploads_rejected_total", "counter", "Uploads refused by the upload quotas.",
+         [({}, uploads["rejected_uploads"])]),
+        ("ia_result_store_bytes", "gauge", "Bytes of results waiting for download.",
+         [({}, results["bytes"])]),
+        ("ia_cache_hits_total", "counter", "Cache hits by cache.", [
+            ({"cache": "ocr_memory"}, ocr["memory_hits"]),
+            ({"cache": "ocr_disk"}, ocr["disk_hits"]),
+            ({"cache": "llm"}, llm["hits"]),
+            ({"cache": "docx"}, docx["hits"]),
+        ]),
+        ("ia_cache_misses_total", "counter", "Cache misses by cache.", [
+            ({"cache": "ocr"}, ocr["misses"]),
+            ({"cache": "llm"}, llm["misses"]),
+            ({"cache": "docx"}, docx["misses"]),
+        ]),
+        ("ia_blank_pages_skipped_total", "counter", "Pages classified blank locally (no GPT call), by when.", [
+            ({"stage": "before_ocr"}, blank["ocr_calls_avoided"]),
+            ({"stage": "after_ocr"}, blank["calls_avoided"] - blank["ocr_calls_avoided"]),
+        ]),
+        ("ia_provider_ready", "gauge", "1 when the provider client is built and warm.",
+         [({"provider": name}, int(state["ready"])) for name, state in clients.items()]),
+    ]
+
+
+registry.add_collector(collect_app_stats)
+
+
+
+
+# GET with api_key query param or x-api-key header (scrapers can do either)
+@app.get("/metrics", tags=["meta"])
+async def metrics(
+    api_key: Optional[str] = Query(default=None, alias="api_key"),
+    x_api_key: Optional[str] = Header(default=None),
+):
+    """Prometheus text exposition of this worker's metrics."""
+    check_api_key(x_api_key or api_key)
+    return Response(await registry.render(), media_type=CONTENT_TYPE)
+
+
+
+
+@app.get("/jobs/stats", tags=["meta"])
+async def jobs_stats(x_api_key: Optional[str] = Header(default=None)):
+    """Live / finished / evicted job counters and logged event volume."""
+    check_api_key(x_api_key)
+    return {**await job_store.stats(), "scheduler": job_scheduler.stats()}
+
+
+
+
 
 
 @app.post("/jobs/new")
 async def jobs_new(x_api_key: Optional[str] = Header(default=None)):
     """Create an empty job and return its id immediately."""
     check_api_key(x_api_key)
-    job_id = job_store.create_job()
-    uploads_cache[job_id] = []
+    await evict_idle_uploads()
+    job_id = await job_store.create_job()
+    await upload_store.create(job_id)
     return {"job_id": job_id}
 
 
@@ -85,51 +209,114 @@ async def jobs_new(x_api_key: Optional[str] = Header(default=None)):
 
 @app.post("/uploads/batch")
 async def uploads_batch(
+    request: Request,
     job_id: str = Query(...),
-    files: List[UploadFile] = File(...),
     x_api_key: Optional[str] = Header(default=None),
 ):
     """
-    Accept all PDFs in one multipart request and buffer in memory per job_id.
-    No disk writes; keeps confidentiality.
+    Accept all PDFs in one multipart request (field "files") and buffer them in memory per job_id.
+    The body is parsed as it streams in, so nothing is spooled to disk; keeps confidentiality.
+    Answers 413 past the per-job limit and 429 (+ Retry-After) when the global buffer is full.
     """
     check_api_key(x_api_key)
-    bucket = uploads_cache.get(job_id)
-    if bucket is None:
-        raise HTTPException(status_code=404, detail="Unknown job_id")
-
-    received = 0
-    for f in files:
-        content = await f.read()
-        filename = getattr(f, "filename", getattr(f, "name", "upload.pdf"))
-        bucket.append({"filename": filename, "content": content})
-        received += 1
+    await evict_idle_uploads()
+    if not await upload_store.exists(job_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired job_id")
+
+    # A declared body that can't fit is refused before a byte of it is read
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > upload_store.job_max_bytes + UPLOAD_FORM_OVERHEAD:
+        upload_store.rejected_uploads += 1
+        raise HTTPException(status_code=413,
+                            detail=f"Upload exceeds the per-job limit of {upload_store.job_max_bytes} bytes")
+
+    form = MultipartFiles.for_content_type(request.headers.get("content-type", ""))
+    if form is None:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data body")
+
+    # Reserve quota per UPLOAD_READ_CHUNK received, so oversized uploads stop early
+    reserved = 0
+    try:
+        async for chunk in request.stream():
+            form.write(chunk)
+            if form.pending >= UPLOAD_READ_CHUNK:
+                nbytes = form.take_pending()
+                await upload_store.reserve(job_id, nbytes)
+                reserved += nbytes
+        form.finalize()
+        nbytes = form.take_pending()
+        await upload_store.reserve(job_id, nbytes)
+        reserved += nbytes
+    except UploadRejected as exc:
+        await upload_store.release(job_id, reserved)
+        headers = {"Retry-After": str(exc.retry_after)} if exc.retry_after else None
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail, headers=headers)
+    except (MultipartParseError, ClientDisconnect):
+        await upload_store.release(job_id, reserved)
+        raise HTTPException(status_code=400, detail="Malformed or interrupted multipart body")
+
+    if not form.files:
+        raise HTTPException(status_code=422, detail='No file in the "files" field')
+    # Parts are stored as received (no bytes() copy) and dropped from the form
+    # one by one, so no file is ever held twice
+    received = len(form.files)
+    while form.files:
+        f = form.files.pop(0)
+        await upload_store.add_file(job_id, f["filename"], f["content"])
+        uploaded_files.inc()
+    uploaded_bytes.inc(reserved)
 
     return {"job_id": job_id, "received": received}
 
 
 
 
+@app.get("/uploads/stats")
+async def uploads_stats(x_api_key: Optional[str] = Header(default=None)):
+    """Live usage of the in-memory upload buffers."""
+    check_api_key(x_api_key)
+    return await upload_store.stats()
+
+
+
+
+
+def tenant_of(x_tenant: Optional[str], x_api_key: Optional[str]) -> str:
+    """
+    Fair-share key for the scheduler.
+    A key from TENANT_API_KEYS decides the tenant on the server side. With the
+    shared API_KEY the server can't tell callers apart: front-ends must send
+    X-Tenant (e.g. the cabinet id), or all their jobs share the "default"
+    tenant and the round-robin is plain FIFO. X-Tenant is declared by the
+    client, so it only shares fairly between cooperating front-ends.
+    """
+    if x_api_key in TENANT_API_KEYS:
+        return TENANT_API_KEYS[x_api_key]
+    return x_tenant or "default"
+
+
+
 
 @app.post("/summaries/commit")
 async def summaries_commit(
-    background_tasks: BackgroundTasks,
     job_id: str = Query(...),
     x_api_key: Optional[str] = Header(default=None),
+    x_tenant: Optional[str] = Header(default=None),
 ):
     """
     Start processing after all files are uploaded.
-    Pulls the in-memory batch and enqueues start_processing(job_id, files).
+    Pulls the in-memory batch and queues start_processing(job_id, files) in the bulk lane.
     """
     check_api_key(x_api_key)
-    buffered_files = uploads_cache.pop(job_id, None)
-    if buffered_files is None:
-        raise HTTPException(status_code=404, detail="Unknown job_id")
+    buffered_files = await pop_uploads(job_id)
     if not buffered_files:
+        await upload_store.finish(job_id)
+        await job_store.discard(job_id)  # the job will never run: don't keep its entry
         raise HTTPException(status_code=400, detail="No files uploaded for this job_id")
 
-    background_tasks.add_task(start_processing, job_id, buffered_files)
-    return {"job_id": job_id, "status": "queued"}
+    position = await job_scheduler.submit(job_id, start_processing, buffered_files,
+                                          lane="bulk", tenant=tenant_of(x_tenant, x_api_key))
+    return {"job_id": job_id, "status": "queued", "position": position}
 
 
 
@@ -138,23 +325,24 @@ async def summaries_commit(
 
 @app.post("/pdf2word/commit")
 async def pdf2word_commit(
-    background_tasks: BackgroundTasks,
     job_id: str = Query(...),
     x_api_key: Optional[str] = Header(default=None),
+    x_tenant: Optional[str] = Header(default=None),
 ):
     """
     Start the PDF → Word conversion after upload.
-    Accepts **exactly one** PDF buffered in uploads_cache[job_id].
+    Accepts **exactly one** PDF buffered in upload_store for job_id.
     """
     check_api_key(x_api_key)
-    buffered_files = uploads_cache.pop(job_id, None)
-    if buffered_files is None:
-        raise HTTPException(status_code=404, detail="Unknown job_id")
+    buffered_files = await pop_uploads(job_id)
     if len(buffered_files) != 1:
+        await upload_store.finish(job_id)
+        await job_store.discard(job_id)  # the job will never run: don't keep its entry
         raise HTTPException(status_code=400, detail="Exactly one PDF required")
 
-    background_tasks.add_task(start_pdf_to_word, job_id, buffered_files)
-    return {"job_id": job_id, "status": "queued"}
+    position = await job_scheduler.submit(job_id, start_pdf_to_word, buffered_files,
+                                          lane="interactive", tenant=tenant_of(x_tenant, x_api_key))
+    return {"job_id": job_id, "status": "queued", "position": position}
 
 
 
@@ -165,29 +353,97 @@ async def pdf2word_commit(
 
 @app.post("/docresume/commit")
 async def docresume_commit(
-    background_tasks: BackgroundTasks,
     job_id: str = Query(...),
     x_api_key: Optional[str] = Header(default=None),
+    x_tenant: Optional[str] = Header(default=None),
 ):
     """
     Start single-document résumé generation after upload.
-    Expects exactly one PDF or DOCX already buffered in uploads_cache[job_id].
+    Expects exactly one PDF or DOCX already buffered in upload_store for job_id.
     """
     check_api_key(x_api_key)
-    buffered = uploads_cache.pop(job_id, None)
-    if buffered is None:
-        raise HTTPException(status_code=404, detail="Unknown job_id")
+    buffered = await pop_uploads(job_id)
     if len(buffered) != 1:
+        await upload_store.finish(job_id)
+        await job_store.discard(job_id)  # the job will never run: don't keep its entry
         raise HTTPException(status_code=400, detail="Exactly one document required")
 
-    background_tasks.add_task(start_doc_resume, job_id, buffered)
-    return {"job_id": job_id, "status": "queued"}
+    position = await job_scheduler.submit(job_id, start_doc_resume, buffered,
+                                          lane="interactive", tenant=tenant_of(x_tenant, x_api_key))
+    return {"job_id": job_id, "status": "queued", "position": position}
+
+
+
+
+
+
+
+
+# Token in the query string: the browser downloads through a plain link
+@app.get("/jobs/{job_id}/result")
+async def job_result(
+    job_id: str,
+    token: str = Query(...),
+    range_header: Optional[str] = Header(default=None, alias="Range"),
+):
+    """
+    Raw bytes of a finished artifact (DOCX), announced by the `result` event.
+    Supports single `Range: bytes=…` requests; the artifact is freed once it
+    has been sent whole without a Range header (ranged and resumed downloads
+    may still need any part of it), else when RESULT_TTL expires.
+    """
+    entry = await result_store.get(job_id, token)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired result")
+
+    content = entry["content"]
+    size = len(content)
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    start, end = byte_range or (0, size - 1)
+
+    headers = {
+        "Content-Length": str(end - start + 1),
+        "Content-Disposition": content_disposition(entry["filename"]),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "no-store",
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
 
+    async def body():
+        view = memoryview(content)
+        for offset in range(start, end + 1, RESULT_CHUNK):
+            yield bytes(view[offset:min(offset + RESULT_CHUNK, end + 1)])
+        if byte_range is None:
+            await result_store.mark_downloaded(job_id)
 
+    return StreamingResponse(body(), status_code=206 if byte_range else 200,
+                             media_type=entry["mime"], headers=headers)
 
 
 
 
+@app.get("/results/stats", tags=["meta"])
+async def results_stats(x_api_key: Optional[str] = Header(default=None)):
+    """Artifacts waiting for download, downloaded / expired counters."""
+    check_api_key(x_api_key)
+    return await result_store.stats()
+
+
+
+
+def parse_last_event_id(*candidates: Optional[str]) -> int:
+    """First usable Last-Event-ID (header on auto-reconnect, query param otherwise)."""
+    for value in candidates:
+        if value and value.strip().isdigit():
+            return int(value.strip())
+    return 0
+
+
 
 
 # GET uses query param (EventSource can't send headers)
@@ -195,38 +451,46 @@ async def docresume_commit(
 async def summaries_stream(
     job_id: str,
     api_key: Optional[str] = Query(default=None, alias="api_key"),
+    last_event_id: Optional[str] = Query(default=None, alias="last_event_id"),
+    last_event_id_header: Optional[str] = Header(default=None, alias="Last-Event-ID"),
 ):
-    """SSE stream of progress/messages/results for a given job_id."""
+    """
+    SSE stream of progress/messages/results for a given job_id.
+    Every event carries an `id:`; reconnecting with Last-Event-ID (header, or
+    ?last_event_id=) resumes right after it. Several tabs can follow one job.
+    """
     check_api_key(api_key)
-    if not job_store.exists(job_id):
+    if not await job_store.exists(job_id):
         raise HTTPException(status_code=404, detail="Unknown job_id")
+    after = parse_last_event_id(last_event_id_header, last_event_id)
 
     async def event_source():
-        # Preamble to defeat proxy/client buffering
-        yield "retry: 2000\n"
-        yield ":" + (" " * 2048) + "\n\n"
-
-        q = job_store.get_queue(job_id)
-        last_beat = time.time()
-
-        while True:
-            try:
-                # Wait up to 1s for the next item; if none, send a heartbeat
-                item = await asyncio.wait_for(q.get(), timeout=1.0)
-                # Proper SSE event with double newline
-                payload = json.dumps(item, ensure_ascii=False)
-                yield f"data: {payload}\n\n"
+        nonlocal after
+        sse_connections.inc()
+        try:
+            # Preamble to defeat proxy/client buffering
+            yield "retry: 2000\n"
+            yield ":" + (" " * 2048) + "\n\n"
+
+            while await job_store.exists(job_id):  # stops if evicted (retention window over)
+                # Wait up to 1s for new events; if none, send a heartbeat
+                events = await job_store.wait_events(job_id, after, timeout=1.0)
+                if not events:
+                    # Heartbeat comment (keeps buffers open and flushing)
+                    yield f": hb {int(time.time())}\n\n"
+                    await asyncio.sleep(0)
+                    continue
+
+                for seq, event, payload in events:
+                    # Proper SSE event with id and double newline
+                    yield f"id: {seq}\ndata: {payload}\n\n"
+                    after = seq
+                    if event == "done":
+                        return
                 # Let the loop cycle so the transport flushes now
                 await asyncio.sleep(0)
-
-                if isinstance(item, dict) and item.get("event") == "done":
-                    break
-
-                last_beat = time.time()
-            except asyncio.TimeoutError:
-                # Heartbeat comment (keeps buffers open and flushing)
-                yield f": hb {int(time.time())}\n\n"
-                await asyncio.sleep(0)
+        finally:
+            sse_connections.dec()
 
     headers = {
         "Content-Type": "text/event-stream; charset=utf-8",
@@ -246,9 +510,11 @@ async def summaries_stream(
 async def pdf2word_stream(
     job_id: str,
     api_key: Optional[str] = Query(default=None, alias="api_key"),
+    last_event_id: Optional[str] = Query(default=None, alias="last_event_id"),
+    last_event_id_header: Optional[str] = Header(default=None, alias="Last-Event-ID"),
 ):
     # Re-use the same SSE logic
-    return await summaries_stream(job_id, api_key)
+    return await summaries_stream(job_id, api_key, last_event_id, last_event_id_header)
 
 
 
@@ -261,6 +527,8 @@ async def pdf2word_stream(
 async def docresume_stream(
     job_id: str,
     api_key: Optional[str] = Query(default=None, alias="api_key"),
+    last_event_id: Optional[str] = Query(default=None, alias="last_event_id"),
+    last_event_id_header: Optional[str] = Header(default=None, alias="Last-Event-ID"),
 ):
     # Re-use the same SSE generator
-    return await summaries_stream(job_id, api_key)  # type: ignore
+    return await summaries_stream(job_id, api_key, last_event_id, last_event_id_header)  # type: ignore